@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import threading
+
+class AlarmCollector:
+    """
+    Collects the stocks exceeding their RSI thresholds while they are evaluated.
+    All alarms are counted, but only the top_k most extreme stocks per direction are kept
+    for the report, so memory does not grow with the universe. Safe to use from several threads.
+    \n
+    Constructor Params:
+    - top_k  -- number of stocks kept per direction
+    - is_due -- optional callable(symbol, zone) deciding if an alarm is reported, e.g. notifications.AlarmState.is_due.
+                Alarms which are not due are only counted.
+    """
+
+    def __init__(self, top_k, is_due=None):
+        self.top_k = top_k
+        self.is_due = is_due
+        self.lock = threading.Lock()
+        # Tie breaker, so stocks themselves are never compared
+        self.sequence = itertools.count()
+        # Heaps with the least extreme kept stock on top: highest RSI below, lowest RSI above
+        self.below = []
+        self.above = []
+        self.below_count = 0
+        self.above_count = 0
+        self.below_due = 0
+        self.above_due = 0
+        # symbol -> (zone, source) of all alarms, zone -1 below and 1 above. Rule alarms use rule_key as symbol.
+        self.zones = {}
+        # rule name -> [count, due count, [(stock, since date) of the first top_k due alarms]]
+        self.rules = {}
+
+    def add_below(self, stock):
+        due = self.is_due is None or self.is_due(stock.symbol, -1)
+        with self.lock:
+            self.below_count += 1
+            self.zones[stock.symbol] = (-1, stock.source)
+            if (due):
+                self.below_due += 1
+                self.push(self.below, (-stock.last_rsi, next(self.sequence), stock))
+
+    def add_above(self, stock):
+        due = self.is_due is None or self.is_due(stock.symbol, 1)
+        with self.lock:
+            self.above_count += 1
+            self.zones[stock.symbol] = (1, stock.source)
+            if (due):
+                self.above_due += 1
+                self.push(self.above, (stock.last_rsi, next(self.sequence), stock))
+
+    def add_rule(self, rule, stock, since):
+        """Adds a stock for which the named rules.Rule holds since the given date."""
+        key = self.rule_key(rule, stock.symbol)
+        due = self.is_due is None or self.is_due(key, 1)
+        with self.lock:
+            counts = self.rules.setdefault(rule, [0, 0, []])
+            counts[0] += 1
+            self.zones[key] = (1, stock.source)
+            if (due):
+                counts[1] += 1
+                if (len(counts[2]) < self.top_k):
+                    counts[2].append((stock, since))
+
+    @staticmethod
+    def rule_key(rule, symbol):
+        return f'{symbol}|{rule}'
+
+    def get_rules(self):
+        """Returns a dict of rule name to (count, due count, [(stock, since date) of the kept due alarms])."""
+        with self.lock:
+            return {rule: (count, due, list(kept)) for rule, (count, due, kept) in self.rules.items()}
+
+    def push(self, heap, entry):
+        if (len(heap) < self.top_k):
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+
+    def merge(self, other):
+        """Adds the alarms of another AlarmCollector, e.g. of another process evaluating a part of the universe.
+        Its alarms were already checked with its is_due."""
+        with self.lock:
+            self.below_count += other.below_count
+            self.above_count += other.above_count
+            self.below_due += other.below_due
+            self.above_due += other.above_due
+            self.zones.update(other.zones)
+            for rsi, _, stock in other.below:
+                self.push(self.below, (rsi, next(self.sequence), stock))
+            for rsi, _, stock in other.above:
+                self.push(self.above, (rsi, next(self.sequence), stock))
+            for rule, (count, due, kept) in other.rules.items():
+                counts = self.rules.setdefault(rule, [0, 0, []])
+                counts[0] += count
+                counts[1] += due
+                counts[2].extend(kept[:self.top_k - len(counts[2])])
+
+    def __getstate__(self):
+        # Sent to other processes without lock and is_due
+        state = self.__dict__.copy()
+        for name in ('lock', 'is_due', 'sequence'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.is_due = None
+        self.sequence = itertools.count()
+
+    def get_below(self):
+        """Returns the kept stocks below their min RSI which are due, lowest RSI first."""
+        with self.lock:
+            return [stock for _, _, stock in sorted(self.below, key=lambda entry: -entry[0])]
+
+    def get_above(self):
+        """Returns the kept stocks above their max RSI which are due, lowest RSI first."""
+        with self.lock:
+            return [stock for _, _, stock in sorted(self.above)]
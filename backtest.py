@@ -0,0 +1,154 @@
+"""
+Replays the stored prices of a universe and evaluates the RSI thresholds of every symbol on every
+trading day at once, to see how often they alarm and what the prices did afterwards.
+Only reads the price DB of the universe, fill it with a normal run first.
+
+Usage:
+    python backtest.py --source iex --start 2000-01-01 --end 2019-12-31
+    python backtest.py --source quandl --thresholds 25 75 --horizons 5 20 60
+    python backtest.py --source iex --daily-counts backtest_history.csv --symbol-stats backtest_symbols.csv
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+import helpers
+import monitor
+import technical_indicators
+import trading_calendar
+
+logger = logging.getLogger(__name__)
+
+class Backtest:
+    """
+    Evaluates the RSI thresholds of a universe on every trading day of a price matrix in one
+    vectorized pass. Alarms are the days on which a symbol is below its min RSI or above its max RSI,
+    like in monitor.evaluate_rsi. A new alarm is the first day of such a streak, which is what
+    notifications.AlarmState mails.
+    \n
+    Constructor Params:
+    - closings -- pandas.DataFrame of closing prices on the trading days, ascending dates as index, one column per symbol
+    - min_rsi  -- numpy array of the min RSI of every column
+    - max_rsi  -- numpy array of the max RSI of every column
+    """
+
+    def __init__(self, closings, min_rsi, max_rsi):
+        self.closings = closings
+        self.prices = closings.to_numpy(dtype=float)
+        self.rsi = technical_indicators.rsi_matrix(self.prices, 14)
+        # rsi_matrix skips days without a price, e.g. after delisting, and has no RSI on them and on the day after
+        has_rsi = ~np.isnan(self.rsi)
+        with np.errstate(invalid='ignore'):
+            self.below = has_rsi & (self.rsi < min_rsi)
+            self.above = has_rsi & (self.rsi > max_rsi)
+        self.has_rsi = has_rsi
+        self.new_below = self.below & ~self.shift(self.below)
+        self.new_above = self.above & ~self.shift(self.above)
+
+    def shift(self, mask):
+        """Returns the mask of the day before, False on the first day."""
+        shifted = np.zeros_like(mask)
+        shifted[1:] = mask[:-1]
+        return shifted
+
+    def get_daily_counts(self):
+        """Returns the number of symbols below and above their thresholds per day, like data/history.csv."""
+        counts = pd.DataFrame({'below': self.below.sum(axis=1), 'above': self.above.sum(axis=1),
+            'total': self.has_rsi.sum(axis=1)}, index=self.closings.index)
+        counts.index.name = 'Date'
+        return counts[counts['total'] > 0]
+
+    def get_forward_returns(self, horizon):
+        """Returns the relative price change from every day to horizon trading days later, NaN where unknown."""
+        returns = np.full(self.prices.shape, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns[:-horizon] = self.prices[horizon:] / self.prices[:-horizon] - 1.0
+        return returns
+
+    def get_summary(self, horizons):
+        """Returns a pandas.DataFrame with one row per alarm kind: how often it occurs and the
+        forward returns after it, next to the returns after any day as baseline."""
+        days = self.has_rsi.sum()
+        years = max(len(self.closings.index) / 252.0, 1.0 / 252.0)
+        kinds = {'any day': self.has_rsi, 'below': self.below, 'above': self.above,
+            'new below': self.new_below, 'new above': self.new_above}
+        returns = {horizon: self.get_forward_returns(horizon) for horizon in horizons}
+        rows = {}
+        for kind, mask in kinds.items():
+            row = {'days': int(mask.sum()), 'share of days': mask.sum() / days if days > 0 else np.nan,
+                'per symbol and year': mask.sum() / max(self.prices.shape[1], 1) / years}
+            for horizon, forward_returns in returns.items():
+                values = forward_returns[mask & ~np.isnan(forward_returns)]
+                row[f'mean return {horizon}d'] = values.mean() if values.size > 0 else np.nan
+                row[f'median return {horizon}d'] = np.median(values) if values.size > 0 else np.nan
+                row[f'up share {horizon}d'] = (values > 0).mean() if values.size > 0 else np.nan
+            rows[kind] = row
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def get_symbol_stats(self):
+        """Returns per symbol the number of days with RSI, below and above, and the new alarms of both."""
+        stats = pd.DataFrame({'days': self.has_rsi.sum(axis=0), 'below': self.below.sum(axis=0),
+            'above': self.above.sum(axis=0), 'new below': self.new_below.sum(axis=0),
+            'new above': self.new_above.sum(axis=0)}, index=self.closings.columns)
+        stats.index.name = 'Symbol'
+        return stats
+
+def load_closings(data_access, source, symbols, start_date, end_date):
+    """
+    Returns the stored closing prices of the symbols on the trading days of their exchange between
+    start_date and end_date. Days without a price carry the last one, but not after a symbol's last price.
+    """
+    closings = data_access.get_close_matrix(symbols)
+    closings.index = pd.to_datetime(closings.index)
+    closings = closings[start_date:end_date]
+    days = trading_calendar.get_calendar(source, start_date, end_date).days
+    listed = closings.notna().iloc[::-1].cummax().iloc[::-1]
+    aligned = closings.ffill().reindex(days, method='ffill')
+    listed = listed.reindex(days, method='ffill').fillna(False).astype(bool)
+    return aligned.where(listed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest the RSI thresholds of a universe on the stored prices.')
+    parser.add_argument('--source', default='iex', choices=monitor.universes.keys(), help='universe to backtest')
+    parser.add_argument('--start', default='1990-01-01', help='first date, yyyy-mm-dd')
+    parser.add_argument('--end', default=pd.Timestamp.now().strftime('%Y-%m-%d'), help='last date, yyyy-mm-dd')
+    parser.add_argument('--thresholds', type=float, nargs=2, metavar=('MIN_RSI', 'MAX_RSI'), help='use these thresholds for all symbols instead of config.ini')
+    parser.add_argument('--horizons', type=int, nargs='+', default=[5, 20, 60], help='trading days of the forward returns')
+    parser.add_argument('--daily-counts', help='write the daily counts in the format of data/history.csv to this file')
+    parser.add_argument('--symbol-stats', help='write the alarm counts per symbol to this csv file')
+    args = parser.parse_args()
+    helpers.setup_logging()
+
+    # Symbols which stopped trading are part of the past
+    entries = monitor.read_universe(args.source, f'{monitor.universes[args.source]}.csv', skip_stale=False)
+    symbols = [symbol for _, symbol, _, _ in entries]
+    if (args.thresholds):
+        min_rsi = np.full(len(entries), args.thresholds[0])
+        max_rsi = np.full(len(entries), args.thresholds[1])
+    else:
+        min_rsi = np.array([entry[2] for entry in entries], dtype=float)
+        max_rsi = np.array([entry[3] for entry in entries], dtype=float)
+
+    start = time.perf_counter()
+    data_access = monitor.get_store(args.source)
+    closings = load_closings(data_access, args.source, symbols, args.start, args.end)
+    # Symbols without stored prices have no column
+    stored = np.array([symbol in closings.columns for symbol in symbols])
+    closings = closings[[symbol for symbol in symbols if symbol in closings.columns]]
+    backtest = Backtest(closings, min_rsi[stored], max_rsi[stored])
+    summary = backtest.get_summary(args.horizons)
+    logger.info(f'Backtested {closings.shape[1]} symbols on {closings.shape[0]} days in {time.perf_counter() - start:.1f} s')
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+        print(summary)
+    if (args.daily_counts):
+        backtest.get_daily_counts().to_csv(args.daily_counts, sep='\t', encoding='utf-8')
+    if (args.symbol_stats):
+        backtest.get_symbol_stats().to_csv(args.symbol_stats)
+
+if __name__ == '__main__':
+    main()
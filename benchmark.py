@@ -0,0 +1,217 @@
+"""
+Times the phases of a monitor run against a local synthetic data source, so no Quandl/IEX/Stooq
+requests are made. Everything is written into a temporary working directory.
+
+Usage:
+    python benchmark.py --symbols 100 500 5000 --latency 0.01 --failure-rate 0.05
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --tolerance 0.25
+    python benchmark.py --symbols --startup-budget 1.5
+
+Peak memory is measured with tracemalloc, which slows down the timed code as well.
+Compare results only against reports of the same machine and options.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import config
+import monitor
+from data_access import DataAccess
+from emailer import Emailer
+from fetcher import FetchScheduler, get_rate_limiter
+from history import History
+from alarms import AlarmCollector
+
+# Seconds a fresh interpreter may take to import the monitor entry point, see measure_startup
+startup_budget = 1.5
+
+class FakeSource:
+    """
+    Deterministic synthetic market data. Every symbol gets its own random walk,
+    the same symbol always yields the same prices for the same dates.
+    \n
+    Constructor Params:
+    - history_days -- number of calendar days the synthetic history reaches back from today
+    - latency      -- seconds every request sleeps to simulate the round trip
+    - failure_rate -- share of symbols which are unknown to the source
+    """
+
+    def __init__(self, history_days, latency, failure_rate):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.dates = pd.bdate_range(end=datetime.now() - timedelta(days=1), periods=history_days * 5 // 7)
+        self.requests = 0
+
+    def read_remote(self, symbols, start_date, end_date, source):
+        """Stands in for DataAccess.read_remote: one symbol gives a frame, a list of symbols
+        a frame with (attribute, symbol) columns like pandas_datareader."""
+        self.requests += 1
+        time.sleep(self.latency)
+        if (isinstance(symbols, str)):
+            df = self.get_prices(symbols, start_date, end_date)
+            if (df is None):
+                raise KeyError(symbols)
+            return df
+        frames = {symbol: self.get_prices(symbol, start_date, end_date) for symbol in symbols}
+        df = pd.concat({symbol: df for symbol, df in frames.items() if not df is None}, axis=1)
+        return df.swaplevel(axis=1)
+
+    def get_prices(self, symbol, start_date, end_date):
+        seed = zlib.crc32(symbol.encode())
+        random = np.random.RandomState(seed)
+        if (random.random_sample() < self.failure_rate):
+            return None
+        closes = 100 * np.exp(np.cumsum(random.normal(0, 0.02, len(self.dates))))
+        df = pd.DataFrame({'Close': closes}, index=self.dates)[start_date:end_date]
+        # Remote sources deliver latest date first
+        return df.iloc[::-1]
+
+class Benchmark:
+    """Runs the phases of one monitor run for a given number of symbols and records time and peak memory."""
+
+    def __init__(self, symbol_count, source):
+        self.symbol_count = symbol_count
+        self.source = source
+        self.results = {}
+
+    def measure(self, phase, function, *args):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = function(*args)
+        wall_time = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.results[phase] = {'seconds': wall_time, 'peak_mb': peak / 2**20}
+        return result
+
+    def count_requests(self, function, *args):
+        requests = self.source.requests
+        result = function(*args)
+        self.results['remote requests'] = {'count': self.source.requests - requests}
+        return result
+
+    def run(self):
+        csv_file = f'universe_{self.symbol_count}.csv'
+        with open(csv_file, 'w') as universe:
+            universe.write('Symbol,Company\n')
+            universe.writelines(f'SYM{index},Synthetic {index}\n' for index in range(self.symbol_count))
+
+        monitor.alarms = AlarmCollector(config.alarm_report_top)
+        scheduler = FetchScheduler('iex')
+        get_rate_limiter('iex').interval = 0
+        data_access = DataAccess(f'benchmark_{self.symbol_count}')
+        data_access.read_remote = self.source.read_remote
+
+        entries = self.measure('csv universe load', monitor.read_universe, 'iex', csv_file)
+        self.measure('remote fetch', self.count_requests, monitor.create_stocks, 'iex', entries, data_access, scheduler)
+        stocks = self.measure('db read', monitor.create_stocks, 'iex', entries, data_access, scheduler)
+        self.measure('rsi compute', monitor.evaluate_rsi, stocks, data_access)
+        message = self.measure('alarm assembly', self.assemble_alarms, stocks)
+        chart = self.measure('history plot', self.plot_history, len(stocks))
+        self.measure('email render', Emailer().create_message, 'benchmark@localhost', 'Benchmark', message, chart)
+        return self.results
+
+    def assemble_alarms(self, stocks):
+        return monitor.get_alarm_message('benchmark', len(stocks), monitor.alarms)
+
+    def plot_history(self, total_stocks):
+        history = History()
+        history.add_date(datetime.strftime(datetime.now(), '%Y-%m-%d'), monitor.alarms.below_count, monitor.alarms.above_count, total_stocks)
+        return history.save_plot(config.history_output_file)
+
+def measure_startup(repetitions=3):
+    """Returns the best wall time of importing monitor in a fresh interpreter, which is paid by every
+    cron run before any work is done. Run from the repository, monitor reads config.ini from there."""
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import monitor'], check=True)
+        times.append(time.perf_counter() - start)
+    return {'seconds': min(times)}
+
+def print_report(report):
+    for symbol_count, results in report.items():
+        print(f'\n{symbol_count}' if symbol_count == 'startup' else f'\n{symbol_count} symbols')
+        for phase, result in results.items():
+            if ('count' in result):
+                print(f'  {phase:<20} {result["count"]:9d}')
+            elif ('peak_mb' in result):
+                print(f'  {phase:<20} {result["seconds"]:9.3f} s {result["peak_mb"]:9.1f} MB')
+            else:
+                print(f'  {phase:<20} {result["seconds"]:9.3f} s')
+
+def compare(report, baseline, tolerance):
+    """Returns the list of phases which got slower than the baseline by more than tolerance."""
+    regressions = []
+    for symbol_count, results in report.items():
+        for phase, result in results.items():
+            if ('seconds' not in result):
+                continue
+            try:
+                before = baseline[symbol_count][phase]['seconds']
+            except KeyError:
+                continue
+            if (result['seconds'] > before * (1 + tolerance)):
+                regressions.append(f'{symbol_count} symbols, {phase}: {before:.3f} s -> {result["seconds"]:.3f} s')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a monitor run against a synthetic data source.')
+    parser.add_argument('--symbols', type=int, nargs='*', default=[100, 500, 5000], help='universe sizes to run, none to only measure the startup')
+    parser.add_argument('--history-days', type=int, default=monitor.DAYS * 2, help='calendar days of synthetic history')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per remote request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of failing remote requests')
+    parser.add_argument('--save', help='write the report as json to this file')
+    parser.add_argument('--compare', help='json report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against --compare')
+    parser.add_argument('--startup-budget', type=float, default=startup_budget, help='seconds the import of monitor may take')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    source = FakeSource(args.history_days, args.latency, args.failure_rate)
+    report = {'startup': {'monitor import': measure_startup()}}
+    working_directory = os.getcwd()
+    benchmark_directory = tempfile.mkdtemp(prefix='stockmonitor_benchmark_')
+    try:
+        os.chdir(benchmark_directory)
+        os.mkdir('data')
+        shutil.copy(os.path.join(working_directory, 'data', 'history.csv'), 'data')
+        for symbol_count in args.symbols:
+            report[str(symbol_count)] = Benchmark(symbol_count, source).run()
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(benchmark_directory, ignore_errors=True)
+
+    print_report(report)
+    over_budget = report['startup']['monitor import']['seconds'] > args.startup_budget
+    if (over_budget):
+        print(f'Startup over budget: {report["startup"]["monitor import"]["seconds"]:.3f} s > {args.startup_budget:.3f} s')
+    if (args.save):
+        with open(args.save, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    if (args.compare):
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if (len(regressions) > 0):
+            sys.exit(1)
+    if (over_budget):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
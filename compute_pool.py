@@ -0,0 +1,74 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import technical_indicators
+from technical_indicators import Indicators
+
+logger = logging.getLogger(__name__)
+
+def compute_columns(input_file, output_file, shape, names, start, stop):
+    """Runs in a pool process: computes the indicators of the symbol columns start:stop."""
+    prices = np.memmap(input_file, dtype=float, mode='r', shape=shape)
+    output = np.memmap(output_file, dtype=float, mode='r+', shape=(len(names),) + shape)
+    columns = np.array(prices[:, start:stop])
+    for index, name in enumerate(names):
+        output[index, :, start:stop] = technical_indicators.get_indicator_matrix(name, columns)
+    output.flush()
+
+class IndicatorPool:
+    """
+    Computes technical_indicators.compute_indicators on a pool of processes, so the CPU bound
+    indicator work of large universes uses all cores. Prices and results are exchanged through
+    memory mapped files in shared memory, the processes only get file names and column ranges.
+    \n
+    Constructor Params:
+    - processes   -- number of worker processes
+    - min_symbols -- frames with fewer symbols are computed in the calling thread,
+                     below that copying prices and results costs more than the processes save
+    """
+
+    def __init__(self, processes, min_symbols):
+        self.processes = processes
+        self.min_symbols = min_symbols
+        # Forked processes would inherit the locks of the threads already running, e.g. of the notifier
+        self.pool = multiprocessing.get_context('spawn').Pool(processes)
+        self.directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+    def compute_indicators(self, closings, indicators=Indicators):
+        """Same as technical_indicators.compute_indicators, split by symbol columns across the pool."""
+        names = [indicator.name for indicator in indicators]
+        symbol_count = closings.shape[1]
+        if (symbol_count < self.min_symbols or self.processes < 2):
+            return technical_indicators.compute_indicators(closings, indicators)
+        parts = self.processes
+
+        shape = closings.shape
+        run = uuid.uuid4().hex
+        input_file = os.path.join(self.directory, f'stockmonitor_{run}_prices')
+        output_file = os.path.join(self.directory, f'stockmonitor_{run}_indicators')
+        try:
+            prices = np.memmap(input_file, dtype=float, mode='w+', shape=shape)
+            prices[:] = closings.to_numpy(dtype=float)
+            prices.flush()
+            output = np.memmap(output_file, dtype=float, mode='w+', shape=(len(names),) + shape)
+            bounds = np.linspace(0, symbol_count, parts + 1, dtype=int)
+            tasks = [(input_file, output_file, shape, names, start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+            logger.debug(f'Computing indicators of {symbol_count} symbols in {parts} processes')
+            self.pool.starmap(compute_columns, tasks)
+            results = {name: pd.DataFrame(np.array(output[index]), index=closings.index, columns=closings.columns)
+                for index, name in enumerate(names)}
+        finally:
+            for file_name in (input_file, output_file):
+                if (os.path.exists(file_name)):
+                    os.remove(file_name)
+        return pd.concat(results, axis=1)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
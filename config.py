@@ -8,16 +8,63 @@ email_smtp_server = config['alarm']['email_smtp_server']
 email_sender = config['alarm']['email_sender']
 email_password = config['alarm']['email_password']
 email_recepients = ast.literal_eval(config['alarm']['email_recepients'])
+alarm_report_top = int(config['alarm']['report_top'])
+email_port = int(config['alarm']['email_port'])
+email_starttls = config['alarm'].getboolean('email_starttls')
+alarm_reminder_days = int(config['alarm']['reminder_days'])
+alarm_state_file = config['alarm']['state_file']
 
 default_min_rsi = int(config['thresholds']['min_rsi'])
 default_max_rsi = int(config['thresholds']['max_rsi'])
+custom_rsis = ast.literal_eval(config['thresholds'].get('custom_rsis', '{}'))
+alarm_rules = ast.literal_eval(config['rules'].get('rules', '{}'))
 
 data_quandl_api_key = config['data']['quandl_api_key']
 data_iex_api_key = config['data']['iex_api_key']
 use_database = config['data']['use_database']
+data_cache_format = config['data']['cache_format']
+data_database = config['data']['database']
+data_connections = int(config['data']['connections'])
 
-history_output_file = config['history']['output_file']
+http_timeout = float(config['http']['timeout'])
+http_retries = int(config['http']['retries'])
+http_backoff = float(config['http']['backoff'])
+http_max_backoff = float(config['http']['max_backoff'])
+http_breaker_failures = int(config['http']['breaker_failures'])
+http_breaker_cooldown = float(config['http']['breaker_cooldown'])
+
+incremental_indicators = config['indicators'].getboolean('incremental')
+indicator_processes = int(config['indicators']['processes'])
+indicator_pool_min_symbols = int(config['indicators']['pool_min_symbols'])
+
+fetch_workers_per_source = ast.literal_eval(config['fetch']['workers'])
+fetch_requests_per_second_per_source = ast.literal_eval(config['fetch']['requests_per_second'])
+fetch_batch_size_per_source = ast.literal_eval(config['fetch']['batch_size'])
+fetch_chunk_size = int(config['fetch']['chunk_size'])
+fetch_success_ttl = float(config['fetch']['success_ttl'])
+fetch_failure_recheck = float(config['fetch']['failure_recheck'])
+fetch_max_recheck = float(config['fetch']['max_recheck'])
+fetch_stale_days = int(config['fetch']['stale_days'])
+
+daemon_schedule = ast.literal_eval(config['daemon']['schedule'])
+
+log_level = config['logging']['level']
+run_report_file = config['logging']['run_report']
+
+history_output_file = ast.literal_eval(config['history']['output_file'])
 
 def custom_rsi(symbol):
     '''Returns custom rsi as array if present for that symbol. Raises KeyError if not present.'''
-    return ast.literal_eval(config['thresholds']['custom_rsis'])[symbol]
\ No newline at end of file
+    return custom_rsis[symbol]
+
+def fetch_workers(source):
+    '''Returns the number of concurrent fetch workers for that source. Defaults to 1.'''
+    return fetch_workers_per_source.get(source, 1)
+
+def fetch_requests_per_second(source):
+    '''Returns the allowed remote requests per second for that source. 0 means unlimited.'''
+    return fetch_requests_per_second_per_source.get(source, 0)
+
+def fetch_batch_size(source):
+    '''Returns the number of symbols requested together from that source. Defaults to 1.'''
+    return max(1, fetch_batch_size_per_source.get(source, 1))
\ No newline at end of file
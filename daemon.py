@@ -0,0 +1,180 @@
+"""
+Resident service mode. Keeps the universe, trading calendar and DB connections
+of every scheduled source in memory and evaluates each source on the trading days of its exchange,
+once the closing prices of the day are published. See [daemon] in config.ini.
+
+Usage:
+    python daemon.py
+    python daemon.py --now    also evaluate the last session of every source right away
+"""
+
+import argparse
+import logging
+import os
+import signal
+import threading
+
+import pandas as pd
+
+import config
+import helpers
+import monitor
+import trading_calendar
+from alarms import AlarmCollector
+from fetcher import FetchScheduler
+from instrumentation import report
+from stock import Stock
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the clock while waiting, so a suspended machine does not delay an evaluation
+check_interval = 60
+
+# Session date (yyyy-mm-dd) to a dict of source to its (below, above, total) counts, see add_session_counts
+session_counts = {}
+# Most recent session dates kept in session_counts
+kept_sessions = 7
+
+def add_session_counts(session, source, counts):
+    """Records the (below, above, total) counts of the evaluation of a source and returns the sums over all sources
+    evaluated for the same session, so the history gets one row per session holding the counts of all sources."""
+    sources = session_counts.setdefault(session, {})
+    sources[source] = counts
+    for date in sorted(session_counts)[:-kept_sessions]:
+        del session_counts[date]
+    return [sum(values) for values in zip(*sources.values())]
+
+class SourceService:
+    """
+    Everything needed to evaluate one remote source, created once and reused by all its evaluations.
+    \n
+    Constructor Params:
+    - source      -- remote source, key of monitor.universes
+    - timezone    -- timezone of the exchange of the source, e.g. Europe/Berlin
+    - time_of_day -- local time (HH:MM) at which the closing prices of a session are evaluated
+    - days_after  -- days after the session the evaluation runs on, for sources publishing after midnight
+    """
+
+    def __init__(self, source, timezone, time_of_day, days_after=0):
+        self.source = source
+        self.timezone = timezone
+        self.time_of_day = time_of_day
+        self.days_after = pd.Timedelta(days=days_after)
+        self.csv_file = f'{monitor.universes[source]}.csv'
+        self.scheduler = FetchScheduler(source)
+        self.data_access = monitor.get_store(source)
+        self.entries = None
+        self.universe_mtime = None
+
+    def get_universe(self):
+        """Returns the universe entries. The csv file is only read again after it changed."""
+        mtime = os.path.getmtime(self.csv_file)
+        if (self.entries is None or mtime != self.universe_mtime):
+            self.entries = monitor.read_universe(self.source, self.csv_file)
+            self.universe_mtime = mtime
+            logger.info(f'{self.source}: Loaded {len(self.entries)} symbols from {self.csv_file}')
+        return self.entries
+
+    def get_next_run(self, now):
+        """Returns (session, run time) of the first evaluation after now, both tz aware pandas.Timestamp."""
+        local_now = now.tz_convert(self.timezone)
+        start_date = (local_now - self.days_after).strftime('%Y-%m-%d')
+        end_date = (local_now + pd.Timedelta(days=14)).strftime('%Y-%m-%d')
+        for session in trading_calendar.get_calendar(self.source, start_date, end_date).days:
+            run_at = pd.Timestamp(f'{session + self.days_after:%Y-%m-%d} {self.time_of_day}').tz_localize(self.timezone)
+            if (run_at > local_now):
+                return session, run_at
+
+    def get_last_session(self, now):
+        """Returns the last session whose evaluation time is not after now."""
+        local_now = now.tz_convert(self.timezone) - self.days_after
+        # Sessions of this day are only evaluated from time_of_day on
+        if (local_now.strftime('%H:%M') >= self.time_of_day):
+            local_now += pd.Timedelta(days=1)
+        return pd.Timestamp(trading_calendar.get_previous_trading_day(self.source, local_now.strftime('%Y-%m-%d')))
+
+    def evaluate(self, session):
+        """Evaluates all prices up to and including the given session and sends the alarm mail.
+        Only the bars published since the last evaluation are fetched and fed into the indicator states."""
+        logger.info(f'{self.source}: Evaluating session {session:%Y-%m-%d}')
+        # Same as the daily run on the morning after the session
+        Stock.today = (session + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        monitor.alarms = AlarmCollector(config.alarm_report_top, monitor.get_alarm_state().is_due)
+        monitor.evaluated_stocks.clear()
+        try:
+            with report.timer('evaluation', self.source):
+                monitor.evaluated_stocks[self.source] = monitor.evaluate_entries(self.source, self.get_universe(), self.data_access, self.scheduler)
+        finally:
+            self.data_access.end_session()
+        date = session.strftime('%Y-%m-%d')
+        counts = (monitor.alarms.below_count, monitor.alarms.above_count, monitor.evaluated_stocks[self.source])
+        monitor.send_alarm(monitor.alarms, date, add_session_counts(date, self.source, counts))
+        report.write(config.run_report_file)
+        report.reset()
+
+class Daemon:
+    """
+    Runs the evaluations of all sources of a schedule until stopped. Evaluations run one after another.
+    \n
+    Constructor Params:
+    - schedule -- dict of remote source to (timezone, time_of_day) or (timezone, time_of_day, days_after), see SourceService
+    """
+
+    def __init__(self, schedule):
+        self.services = [SourceService(source, *times) for source, times in schedule.items()]
+        self.stopped = threading.Event()
+
+    def run(self, now=False):
+        """Waits for and runs the scheduled evaluations. With now=True the last session of every source is evaluated first."""
+        if (now):
+            for service in self.services:
+                self.evaluate(service, service.get_last_session(pd.Timestamp.now(tz='UTC')))
+        pending = {}
+        for service in self.services:
+            pending[service] = self.schedule(service)
+        while (not self.stopped.is_set()):
+            service = min(pending, key=lambda service: pending[service][1])
+            session, run_at = pending[service]
+            delay = (run_at - pd.Timestamp.now(tz='UTC')).total_seconds()
+            if (delay > 0):
+                self.stopped.wait(min(delay, check_interval))
+                continue
+            self.evaluate(service, session)
+            pending[service] = self.schedule(service)
+
+    def schedule(self, service):
+        session, run_at = service.get_next_run(pd.Timestamp.now(tz='UTC'))
+        logger.info(f'{service.source}: Next evaluation of session {session:%Y-%m-%d} at {run_at}')
+        return session, run_at
+
+    def evaluate(self, service, session):
+        """Runs one evaluation. Failures are logged, the daemon keeps running."""
+        try:
+            service.evaluate(session)
+        except Exception:
+            logger.exception(f'{service.source}: Evaluation of session {session:%Y-%m-%d} failed')
+
+    def stop(self, signum=None, frame=None):
+        logger.info('Stopping')
+        self.stopped.set()
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the configured sources after every close of their exchange.')
+    parser.add_argument('--now', action='store_true', help='evaluate the last session of every source on start')
+    args = parser.parse_args()
+    helpers.setup_logging()
+    os.environ["IEX_API_KEY"] = config.data_iex_api_key
+    monitor.indicator_pool = monitor.create_indicator_pool()
+
+    daemon = Daemon(config.daemon_schedule)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    try:
+        daemon.run(args.now)
+    finally:
+        if (not monitor.indicator_pool is None):
+            monitor.indicator_pool.close()
+        monitor.close_notifier()
+
+if __name__ == '__main__':
+    main()
@@ -1,114 +1,609 @@
+import logging
+import os
+import sqlite3
+import threading
+import requests
 import sqlalchemy
 
+import numpy as np
 import pandas as pd
-import pandas_datareader.data as web
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import config
-import helpers
+import trading_calendar
+import http_session
+import fetcher
+from technical_indicators import IndicatorStates
+from price_cache import PriceCache
+from fetch_cache import FetchCache
+from db_writer import DatabaseWriter
+from instrumentation import report
+
+logger = logging.getLogger(__name__)
 
 date_format = '%Y-%m-%d %H:%M:%S'
+db_date_format = '%Y-%m-%d'
+# Stay below SQLite's limit of bound variables per statement
+max_query_parameters = 500
+# Tables of the consolidated layout, any other table is a symbol of the former one-table-per-symbol layout
+tables = {'prices', 'symbols', 'indicator_states', 'fetch_log', 'imports'}
+# Tables of earlier versions of the consolidated layout, dropped and not imported
+obsolete_tables = {'indicator_state'}
 
 class DataAccess:
     def __init__(self, file_name):
-        """Each thread should have its own DataAccess object to avoid race conditions.
-        Also: Each DataAccess object gets its own file to avoid race conditions in multithreading"""
-        sqlite_file = f'sqlite:///data/{file_name}.sqlite'
-        self.database = sqlalchemy.create_engine(sqlite_file)
+        """One DataAccess object can be shared by any number of threads and sources, see get_data_access.
+        Reads run concurrently on a pool of config.data_connections connections to the WAL mode DB.
+        All writes go through a single DatabaseWriter thread, which commits the writes of concurrent
+        threads together. Remote requests are throttled by the fetcher.RateLimiter of their source."""
+        self.file_name = f'data/{file_name}.sqlite'
+        self.database = sqlalchemy.create_engine(f'sqlite:///{self.file_name}', poolclass=sqlalchemy.pool.QueuePool,
+            pool_size=config.data_connections, max_overflow=0,
+            # Pooled connections are used by many threads, one at a time
+            connect_args={'timeout': 30, 'check_same_thread': False})
+        sqlalchemy.event.listen(self.database, 'connect', self.configure_connection)
+        self.writer = DatabaseWriter(self.database, f'DatabaseWriter {file_name}')
+        self.lock = threading.Lock()
+        # Symbols brought up to date by update_symbols, get_df does not request them again
+        self.updated = set()
+        # Prices read by update_symbols for the following get_df calls: symbol to (start_date, end_date, df)
+        self.prefetched = {}
+        self.writer.submit(self.create_tables)
+        # Tables of the former one-table-per-symbol layout, imported on first access
+        self.legacy_tables = set(sqlalchemy.inspect(self.database).get_table_names()) - tables - obsolete_tables
+        self.imports = self.read_imports()
+        self.fetch_cache = FetchCache(timedelta(hours=config.fetch_success_ttl), timedelta(hours=config.fetch_failure_recheck),
+            timedelta(hours=config.fetch_max_recheck), self.read_fetch_log())
+        # Optional file cache of the close price matrix, loaded before this run writes anything
+        self.cache = None
+        self.cached_closings = None
+        if (config.data_cache_format != 'none'):
+            self.cache = PriceCache(file_name, config.data_cache_format)
+            self.cached_closings = self.cache.load(self.get_fingerprint())
+
+    def configure_connection(self, connection, record):
+        cursor = connection.cursor()
+        # Readers don't block the writer and see the last committed state
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def create_tables(self, connection):
+        """Creates the consolidated price table. All symbols share it, keyed on (symbol, date)."""
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE IF NOT EXISTS prices ('
+            'symbol TEXT NOT NULL, date TEXT NOT NULL, close REAL, '
+            'PRIMARY KEY (symbol, date))'))
+        # Last stored date per symbol, so updates don't need to load the stored prices
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE IF NOT EXISTS symbols ('
+            'symbol TEXT PRIMARY KEY, last_date TEXT NOT NULL, updated_at TEXT)'))
+        # Running indicator state per symbol, a row of technical_indicators.IndicatorStates as little endian doubles
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE IF NOT EXISTS indicator_states ('
+            'symbol TEXT PRIMARY KEY, state BLOB NOT NULL)'))
+        # JSON states of earlier versions, advance builds them again from the prices
+        connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS indicator_state'))
+        # Outcome of the last remote request per symbol, see fetch_cache.FetchCache
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE IF NOT EXISTS fetch_log ('
+            'source TEXT NOT NULL, symbol TEXT NOT NULL, start_date TEXT NOT NULL, end_date TEXT NOT NULL, '
+            'checked_at TEXT NOT NULL, failures INTEGER NOT NULL, next_check TEXT NOT NULL, '
+            'PRIMARY KEY (source, symbol))'))
+        # DB files of single universes imported by import_database and their modification time then
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE IF NOT EXISTS imports ('
+            'file_name TEXT PRIMARY KEY, modified_at TEXT NOT NULL, imported_at TEXT NOT NULL)'))
+        connection.execute(sqlalchemy.text(
+            'INSERT OR IGNORE INTO symbols (symbol, last_date) '
+            'SELECT symbol, max(date) FROM prices GROUP BY symbol'))
 
     def write_to_db(self, df, symbol):
-        """Writes a pandas.DataFrame to sql."""
-        print(f'{symbol}: Writing {df.shape[0]} dates to database', flush=True)
-        df.index.names = ['Date']
-        df.to_sql(self.sql_friendly_symbol(symbol), self.database, index=True, if_exists='replace')
+        """Writes the rows of a pandas.DataFrame to sql. Existing dates of that symbol are overwritten."""
+        self.write_frames_to_db({symbol: df})
 
-    def get_df_from_db(self, symbol):
-        """Fetches a Symbol from the DB. Returns None if not available."""
-        df = None
+    def write_frames_to_db(self, frames, wait=True):
+        """Bulk upserts the rows of many symbols in a single transaction.\n
+        frames -- dict of symbol to pandas.DataFrame holding only the rows to write\n
+        wait   -- False returns once the rows are queued, flush waits for them"""
+        rows = []
+        last_dates = []
+        updated_at = datetime.strftime(datetime.now(), date_format)
+        for symbol, df in frames.items():
+            if (df is None or df.size == 0):
+                continue
+            close = df['Close'] if 'Close' in df.columns else df['close']
+            logger.debug(f'{symbol}: Writing {close.shape[0]} dates to database')
+            report.count('rows_written', close.shape[0], symbol=symbol)
+            dates = pd.to_datetime(close.index).strftime(db_date_format)
+            rows.extend({'symbol': symbol, 'date': date, 'close': float(value)} for date, value in zip(dates, close.values))
+            last_dates.append({'symbol': symbol, 'last_date': max(dates), 'updated_at': updated_at})
+        if (len(rows) == 0):
+            return
+
+        def write(connection):
+            with report.timer('db_write'):
+                connection.execute(sqlalchemy.text(
+                    'INSERT OR REPLACE INTO prices (symbol, date, close) VALUES (:symbol, :date, :close)'), rows)
+                connection.execute(sqlalchemy.text(
+                    'INSERT INTO symbols (symbol, last_date, updated_at) VALUES (:symbol, :last_date, :updated_at) '
+                    'ON CONFLICT (symbol) DO UPDATE SET '
+                    'last_date = max(last_date, excluded.last_date), updated_at = excluded.updated_at'), last_dates)
+
+        self.writer.submit(write, wait)
+
+    def flush(self):
+        """Waits until all queued writes are committed."""
+        self.writer.flush()
+
+    def get_last_dates(self, symbols):
+        """Returns a dict of symbol to the datetime of its most recent stored price.
+        Symbols not in the DB are left out."""
+        self.import_legacy_tables(symbols)
+        last_dates = {}
+        for chunk, params, placeholders in self.chunked_symbol_params(symbols):
+            query = sqlalchemy.text(f'SELECT symbol, last_date FROM symbols WHERE symbol IN ({placeholders})')
+            with self.database.connect() as connection:
+                for symbol, last_date in connection.execute(query, params):
+                    last_dates[symbol] = datetime.strptime(last_date, db_date_format)
+        return last_dates
+
+    def get_indicator_states(self, symbols):
+        """Returns the stored states of the symbols as technical_indicators.IndicatorStates in the given order.
+        Symbols without state, or with a state of other Indicators, start empty."""
+        states = IndicatorStates(symbols)
+        for chunk, params, placeholders in self.chunked_symbol_params(symbols):
+            query = sqlalchemy.text(f'SELECT symbol, state FROM indicator_states WHERE symbol IN ({placeholders})')
+            with self.database.connect() as connection:
+                rows = [(symbol, state) for symbol, state in connection.execute(query, params) if len(state) == states.width * 8]
+            if (len(rows) > 0):
+                indices = [states.positions[symbol] for symbol, _ in rows]
+                states.set_rows(indices, np.frombuffer(b''.join(state for _, state in rows), dtype='<f8').reshape(len(rows), states.width))
+        return states
+
+    def write_indicator_states(self, states, changed):
+        """Stores the states of technical_indicators.IndicatorStates where the boolean array changed is set,
+        in a single transaction."""
+        indices = np.flatnonzero(changed)
+        if (len(indices) == 0):
+            return
+        data = states.get_rows(indices).astype('<f8')
+        rows = [{'symbol': states.symbols[index], 'state': row.tobytes()} for index, row in zip(indices, data)]
+        self.writer.submit(lambda connection: connection.execute(sqlalchemy.text(
+            'INSERT OR REPLACE INTO indicator_states (symbol, state) VALUES (:symbol, :state)'), rows))
+
+    def read_imports(self):
+        """Returns a dict of the file name of every imported DB file to its modification time when it was imported."""
+        with self.database.connect() as connection:
+            return dict(connection.execute(sqlalchemy.text('SELECT file_name, modified_at FROM imports')).fetchall())
+
+    def read_fetch_log(self):
+        """Returns the rows of the fetch_log table as dicts with datetimes."""
+        with self.database.connect() as connection:
+            rows = connection.execute(sqlalchemy.text(
+                'SELECT source, symbol, start_date, end_date, checked_at, failures, next_check FROM fetch_log')).fetchall()
+        return [{'source': source, 'symbol': symbol, 'start_date': start_date, 'end_date': end_date,
+            'checked_at': datetime.strptime(checked_at, date_format), 'failures': failures,
+            'next_check': datetime.strptime(next_check, date_format)}
+            for source, symbol, start_date, end_date, checked_at, failures, next_check in rows]
+
+    def write_fetch_log(self):
+        """Stores the fetch results recorded since the last call in a single transaction."""
+        rows = [dict(record, checked_at=datetime.strftime(record['checked_at'], date_format),
+            next_check=datetime.strftime(record['next_check'], date_format)) for record in self.fetch_cache.get_changes()]
+        if (len(rows) == 0):
+            return
+        self.writer.submit(lambda connection: connection.execute(sqlalchemy.text(
+            'INSERT OR REPLACE INTO fetch_log (source, symbol, start_date, end_date, checked_at, failures, next_check) '
+            'VALUES (:source, :symbol, :start_date, :end_date, :checked_at, :failures, :next_check)'), rows))
+
+    def record_fetches(self, frames, start_dates, end_date, source, last_dates):
+        """Records the outcome of the requests of a dict of symbol to fetched pandas.DataFrame, see fetch_cache.FetchCache.
+        start_dates is a dict of symbol to the first requested date, last_dates of symbol to its last stored date.
+        Only symbols without stored prices which got an empty frame failed. Symbols with stored prices
+        may just have no new prices yet."""
+        for symbol, df in frames.items():
+            failed = df.size == 0 and last_dates.get(symbol) is None
+            self.fetch_cache.record(source, symbol, start_dates[symbol], end_date, not failed)
+            if (failed):
+                report.count('remote_failures_recorded', source=source, symbol=symbol)
+
+    def get_fingerprint(self):
+        """Identifies the current state of the stored prices. Changes with every write."""
+        with self.database.connect() as connection:
+            symbol_count, updated_at = connection.execute(sqlalchemy.text('SELECT count(*), max(updated_at) FROM symbols')).fetchone()
+            price_count = connection.execute(sqlalchemy.text('SELECT count(*) FROM prices')).scalar()
+        return f'{symbol_count}|{updated_at}|{price_count}'
+
+    def get_close_matrix(self, symbols=None):
+        """Returns the closing prices of the given (default: all) stored symbols as one pandas.DataFrame
+        with ascending dates as index and one column per symbol. Served from the cache file if configured."""
+        if (self.cached_closings is None):
+            self.refresh_cache()
+        closings = self.cached_closings
+        if (closings is None):
+            closings = self.read_close_matrix()
+        if (symbols is None):
+            return closings
+        return closings[[symbol for symbol in symbols if symbol in closings.columns]]
+
+    def read_close_matrix(self):
+        """Reads the closing prices of all stored symbols with a single query."""
+        # Millions of rows for long histories: skip the per row work of read_sql and pivot
+        connection = self.database.raw_connection()
         try:
-            print(f'{symbol}: Getting from DB', flush=True)
-            df = pd.read_sql('select * from ' + self.sql_friendly_symbol(symbol), self.database, index_col='Date', parse_dates='Date')
-            print(f'{symbol}: is in DB.', flush=True)
-        except (sqlalchemy.exc.OperationalError, KeyError):
-            print(f'{symbol}: not in DB.', flush=True)
+            cursor = connection.cursor()
+            cursor.execute('SELECT symbol, date, close FROM prices')
+            df = pd.DataFrame.from_records(cursor.fetchall(), columns=['symbol', 'date', 'close'])
+        finally:
+            connection.close()
+        date_codes, dates = pd.factorize(df['date'], sort=True)
+        symbol_codes, symbols = pd.factorize(df['symbol'], sort=True)
+        values = np.full((len(dates), len(symbols)), np.nan)
+        values[date_codes, symbol_codes] = df['close'].to_numpy(dtype=float)
+        closings = pd.DataFrame(values, index=pd.to_datetime(dates, format=db_date_format), columns=symbols)
+        closings.index.name = 'date'
+        return closings
+
+    def refresh_cache(self):
+        """Rewrites the cache file from the DB if it does not match the stored prices anymore.
+        Call after all writes of a run, so the next run can load it."""
+        if (self.cache is None):
+            return
+        self.flush()
+        # Sources sharing the DataAccess finish their runs concurrently
+        with self.lock:
+            fingerprint = self.get_fingerprint()
+            self.cached_closings = self.cache.load(fingerprint)
+            if (self.cached_closings is None):
+                self.cache.save(self.read_close_matrix(), fingerprint)
+                self.cached_closings = self.cache.load(fingerprint)
+
+    def get_df_from_cache(self, symbol, start_date, end_date, last_date):
+        """Returns the symbol from the cache file in the same layout as get_df_from_db.
+        Returns None if the cache is not used or does not reach last_date."""
+        if (self.cached_closings is None or symbol not in self.cached_closings.columns):
+            return None
+        close = self.cached_closings[symbol]
+        if (close.last_valid_index() is None or close.last_valid_index() < last_date):
+            return None
+        close = close[start_date:end_date].dropna()
+        df = pd.DataFrame({'Close': close.values[::-1]}, index=close.index[::-1])
+        df.index.names = ['Date']
         return df
 
+    def get_df_from_db(self, symbol, start_date=None, end_date=None):
+        """Fetches a Symbol from the DB. Returns None if not available."""
+        return self.get_dfs_from_db([symbol], start_date, end_date).get(symbol)
+
+    def get_dfs_from_db(self, symbols, start_date=None, end_date=None):
+        """Fetches many symbols from the DB with as few queries as possible.\n
+        Optionally only the dates between start_date and end_date (yyyy-mm-dd, inclusive) are read.\n
+        Returns a dict of symbol to pandas.DataFrame (latest date first). Symbols not in the DB are left out."""
+        self.import_legacy_tables(symbols)
+        date_range = ''
+        if (not start_date is None):
+            date_range += ' AND date >= :start_date'
+        if (not end_date is None):
+            date_range += ' AND date <= :end_date'
+        frames = {}
+        for chunk, params, placeholders in self.chunked_symbol_params(symbols):
+            query = sqlalchemy.text(f'SELECT symbol, date, close FROM prices WHERE symbol IN ({placeholders}){date_range} ORDER BY symbol, date DESC')
+            params.update(start_date=start_date, end_date=end_date)
+            with report.timer('db_read'):
+                df = pd.read_sql(query, self.database, params=params, parse_dates=['date'])
+            for symbol, symbol_df in df.groupby('symbol', sort=False):
+                symbol_df = symbol_df.set_index('date')[['close']].rename(columns={'close': 'Close'})
+                symbol_df.index.names = ['Date']
+                frames[symbol] = symbol_df
+        logger.debug(f'Got {len(frames)} of {len(symbols)} symbols from DB.')
+        return frames
+
+    def chunked_symbol_params(self, symbols):
+        """Splits symbols into chunks that fit into one statement.
+        Yields the chunk, its bind parameters and the matching placeholder list for an IN clause."""
+        for chunk_start in range(0, len(symbols), max_query_parameters):
+            chunk = symbols[chunk_start:chunk_start + max_query_parameters]
+            params = {f's{index}': symbol for index, symbol in enumerate(chunk)}
+            placeholders = ', '.join(f':s{index}' for index in range(len(chunk)))
+            yield chunk, params, placeholders
+
+    def import_legacy_tables(self, symbols):
+        for symbol in symbols:
+            if (self.sql_friendly_symbol(symbol) in self.legacy_tables):
+                self.import_legacy_table(symbol)
+
+    def import_legacy_table(self, symbol):
+        """Moves a symbol stored in its own table (former layout) into the consolidated price table."""
+        table = self.sql_friendly_symbol(symbol)
+        with self.lock:
+            if (table not in self.legacy_tables):
+                return
+            logger.info(f'{symbol}: Importing legacy table {table}')
+            df = pd.read_sql(f'select * from "{table}"', self.database, index_col='Date', parse_dates=['Date'])
+            self.write_to_db(df, symbol)
+            self.writer.submit(lambda connection: connection.execute(sqlalchemy.text(f'DROP TABLE "{table}"')))
+            self.legacy_tables.discard(table)
+
+    def import_database(self, file_name):
+        """Moves the prices, indicator states and fetch results of the DB file of a single universe
+        (former layout, see get_data_access) into this DB. The file itself is left unchanged, the imports table
+        records it, so it is only imported again after it changed. Rows already in this DB are kept."""
+        legacy_file = f'data/{file_name}.sqlite'
+        if (legacy_file == self.file_name or not os.path.exists(legacy_file)):
+            return
+        with self.lock:
+            modified_at = datetime.fromtimestamp(os.path.getmtime(legacy_file)).isoformat(' ')
+            if (self.imports.get(legacy_file) == modified_at):
+                return
+            logger.info(f'Importing {legacy_file} into {self.file_name}')
+            legacy_database = sqlite3.connect(f'file:{legacy_file}?mode=ro', uri=True)
+            try:
+                legacy_tables = [name for name, in legacy_database.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                contents = {}
+                for table in legacy_tables:
+                    if (table in obsolete_tables):
+                        continue
+                    cursor = legacy_database.execute(f'SELECT * FROM "{table}"')
+                    contents[table] = ([column[0] for column in cursor.description], cursor.fetchall())
+            finally:
+                legacy_database.close()
+
+            def write(connection):
+                for table, (columns, rows) in contents.items():
+                    names = ', '.join(f'"{column}"' for column in columns)
+                    if (table not in tables):
+                        # Symbol tables of the one-table-per-symbol layout are imported on first access as before
+                        connection.execute(sqlalchemy.text(f'CREATE TABLE IF NOT EXISTS "{table}" ({names})'))
+                    if (len(rows) > 0):
+                        placeholders = ', '.join(f':c{index}' for index in range(len(columns)))
+                        connection.execute(sqlalchemy.text(f'INSERT OR IGNORE INTO "{table}" ({names}) VALUES ({placeholders})'),
+                            [{f'c{index}': value for index, value in enumerate(row)} for row in rows])
+                connection.execute(sqlalchemy.text(
+                    'INSERT OR REPLACE INTO imports (file_name, modified_at, imported_at) VALUES (:file_name, :modified_at, :imported_at)'),
+                    {'file_name': legacy_file, 'modified_at': modified_at, 'imported_at': datetime.strftime(datetime.now(), date_format)})
+
+            self.writer.submit(write)
+            self.imports[legacy_file] = modified_at
+            self.legacy_tables.update(set(contents) - tables)
+            self.fetch_cache.load(self.read_fetch_log())
+
     def get_df_from_remote(self, symbol, start_date, end_date, source):
         """Fetches the symbol from the given remote source.\n
         Sources can be (so far):\n
         - quandl
         - stooq
         - iex"""
+        df = self.request_remote(symbol, start_date, end_date, source)
+        if (df is None):
+            return pd.DataFrame()
+        return df
+
+    def request_remote(self, symbol, start_date, end_date, source):
+        """Same as get_df_from_remote, but returns None if the source itself failed, see is_source_error.
+        An empty frame means the source answered without prices for the symbol."""
         try:
-            print(f'{symbol}: Fetching from. Start: {start_date}. End: {end_date}. Source: {source}', flush=True)
-            if source == 'quandl':
-                df = web.DataReader(symbol, source, start=start_date, end=end_date, api_key=config.data_quandl_api_key)
-            elif source == 'stooq':
-                df = web.DataReader(symbol, source, start=start_date, end=end_date)
-            elif source == 'iex':
-                df = web.DataReader(symbol, source, start=start_date, end=end_date)
-            else:
-                raise f'Unknown remote source: {source}'
+            fetcher.get_rate_limiter(source).wait()
+            logger.debug(f'{symbol}: Fetching from. Start: {start_date}. End: {end_date}. Source: {source}')
+            report.count('remote_requests', source=source, symbol=symbol)
+            with report.timer('remote_fetch', source, symbol):
+                df = self.read_remote(symbol, start_date, end_date, source)
         except Exception as e:
-            print(f'{symbol}: Returning empty dataframe for {symbol}. Cause: {e}', flush=True)
+            if (is_source_error(e)):
+                logger.warning(f'{symbol}: {source} is unavailable. Cause: {e}')
+                report.count('remote_source_errors', source=source, symbol=symbol)
+                return None
+            logger.warning(f'{symbol}: Returning empty dataframe for {symbol}. Cause: {e}')
+            report.count('remote_errors', source=source, symbol=symbol)
             return pd.DataFrame()
+        report.count('rows_fetched', df.shape[0], source, symbol)
         return df
 
+    def read_remote(self, symbols, start_date, end_date, source):
+        """Requests one symbol or a list of symbols from the remote source via pandas_datareader.
+        Retries are left to the shared session of the source, see http_session.RetryingSession."""
+        # Imported on first use, runs which find all prices in the DB never need it
+        import pandas_datareader.data as web
+        session = http_session.get_session(source)
+        if source == 'quandl':
+            return web.DataReader(symbols, source, start=start_date, end=end_date, api_key=config.data_quandl_api_key, retry_count=0, session=session)
+        elif source == 'stooq':
+            return web.DataReader(symbols, source, start=start_date, end=end_date, retry_count=0, session=session)
+        elif source == 'iex':
+            return web.DataReader(symbols, source, start=start_date, end=end_date, retry_count=0, session=session)
+        raise ValueError(f'Unknown remote source: {source}')
+
+    def get_dfs_from_remote(self, symbols, start_date, end_date, source):
+        """Fetches many symbols from the given remote source, config.fetch_batch_size(source) symbols per request.\n
+        Returns a dict of symbol to pandas.DataFrame. Symbols the source has no prices for get an empty one,
+        symbols which could not be requested because the source failed are left out."""
+        batch_size = config.fetch_batch_size(source)
+        frames = {}
+        for batch_start in range(0, len(symbols), batch_size):
+            frames.update(self.get_batch_from_remote(symbols[batch_start:batch_start + batch_size], start_date, end_date, source))
+        return frames
+
+    def get_batch_from_remote(self, batch, start_date, end_date, source):
+        """Fetches a batch of symbols with a single request and splits the result into one frame per symbol.
+        Falls back to one request per symbol if the batch request fails for another reason than the source itself."""
+        if (len(batch) == 1):
+            return self.request_remote_one_by_one(batch, start_date, end_date, source)
+        try:
+            fetcher.get_rate_limiter(source).wait()
+            logger.debug(f'Fetching {len(batch)} symbols. Start: {start_date}. End: {end_date}. Source: {source}')
+            report.count('remote_requests', source=source)
+            with report.timer('remote_fetch', source):
+                df = self.read_remote(batch, start_date, end_date, source)
+        except Exception as e:
+            if (is_source_error(e)):
+                logger.warning(f'Fetching a batch of {len(batch)} symbols failed, {source} is unavailable. Cause: {e}')
+                report.count('remote_source_errors', source=source)
+                return {}
+            logger.warning(f'Fetching a batch of {len(batch)} symbols failed, fetching them one by one. Cause: {e}')
+            report.count('remote_batch_errors', source=source)
+            return self.request_remote_one_by_one(batch, start_date, end_date, source)
+        frames = {}
+        # Batched results have (attribute, symbol) columns
+        fetched_symbols = set(df.columns.get_level_values(1)) if df.columns.nlevels > 1 else set()
+        for symbol in batch:
+            if (symbol in fetched_symbols):
+                frames[symbol] = df.xs(symbol, axis=1, level=1).dropna(how='all')
+            else:
+                frames[symbol] = pd.DataFrame()
+            if (frames[symbol].size == 0):
+                logger.warning(f'{symbol}: Not contained in batch result from {source}')
+                report.count('remote_errors', source=source, symbol=symbol)
+            report.count('rows_fetched', frames[symbol].shape[0], source, symbol)
+        return frames
+
+    def request_remote_one_by_one(self, symbols, start_date, end_date, source):
+        """Returns a dict of symbol to pandas.DataFrame like get_dfs_from_remote with one request per symbol."""
+        frames = {}
+        for symbol in symbols:
+            df = self.request_remote(symbol, start_date, end_date, source)
+            if (not df is None):
+                frames[symbol] = df
+        return frames
+
+    def update_symbols(self, symbols, start_date, end_date, source, scheduler=None):
+        """Brings many symbols up to end_date with batched remote requests and reads them with as few
+        queries as possible, so the following get_df calls are served from memory. Symbols with similar gaps are requested together, the batches are
+        run on the scheduler's worker pool if one is given."""
+        last_dates = self.get_last_dates(symbols)
+        missing = []
+        for symbol in symbols:
+            last_date = last_dates.get(symbol)
+            if (last_date is None):
+                missing.append((start_date, symbol))
+            elif (not self.is_current(last_date, end_date, source)):
+                missing.append((datetime.strftime(last_date + timedelta(days=1), db_date_format), symbol))
+        due = [(missing_start_date, symbol) for missing_start_date, symbol in missing
+            if self.fetch_cache.is_due(source, symbol, missing_start_date, end_date)]
+        if (len(due) < len(missing)):
+            logger.info(f'{source}: Skipping {len(missing) - len(due)} symbols fetched recently or failing remotely')
+            report.count('fetch_cache_skips', len(missing) - len(due), source)
+        missing = sorted(due)
+        batch_size = config.fetch_batch_size(source)
+        batches = [missing[batch_start:batch_start + batch_size] for batch_start in range(0, len(missing), batch_size)]
+        logger.info(f'{source}: {len(missing)} of {len(symbols)} symbols need an update, fetching them in {len(batches)} batches')
+
+        def fetch_batch(batch):
+            # The batch starts at its earliest missing date, rows already stored are dropped before writing
+            frames = self.get_dfs_from_remote([symbol for _, symbol in batch], batch[0][0], end_date, source)
+            self.record_fetches(frames, {symbol: missing_start_date for missing_start_date, symbol in batch}, end_date, source, last_dates)
+            # The next batch is requested while the writer stores this one
+            self.write_frames_to_db({symbol: self.get_new_rows(df, last_dates.get(symbol)) for symbol, df in frames.items()}, wait=False)
+
+        if (scheduler is None):
+            for batch in batches:
+                fetch_batch(batch)
+        else:
+            scheduler.map(fetch_batch, batches)
+        self.write_fetch_log()
+        self.flush()
+        self.updated.update(symbols)
+        for symbol, df in self.get_dfs_from_db(symbols, start_date, end_date).items():
+            self.prefetched[symbol] = (start_date, end_date, df)
+
+    def end_session(self):
+        """Forgets the symbols brought up to date and the prices read by update_symbols. A long running process
+        calls this after every evaluation, so memory does not grow with it and the next one fetches the new dates."""
+        self.updated.clear()
+        self.prefetched.clear()
+
     def get_df(self, symbol, start_date, end_date, source):
         """This function is intended to use a DB as cache for dataframes so we don't
-        always need to fetch everything anew."""
-        print(f'{symbol}: Getting data. Start: {start_date}. End: {end_date}. Source: {source}', flush=True)
-
-        df = None
-        df_is_new = False
-        missing_df = None
-        # 1. Try get from DB. If available, see if we need to fetch data for missing dates
-        df = self.get_df_from_db(symbol)
-        if (not df is None):
-            if (df.index.is_monotonic_increasing):
-                df = df.iloc[::-1]
-            last_db_date_object = df.index[0]
-            print(f'{symbol}: Last date in DB: {last_db_date_object}', flush=True)
-            desired_last_date_object = datetime.strptime(end_date, '%Y-%m-%d')
-            date_delta_in_days = abs((last_db_date_object - desired_last_date_object).days)
-            print (f'{symbol}: Date delta: {date_delta_in_days}')
-            # 1.1. If we miss dates fetch them and add to df
-            if (date_delta_in_days > 1):
-                new_start_date = helpers.get_date_in_the_past(date_delta_in_days - 1)
-                print(f'{symbol}: Fetching values since {new_start_date}.', flush=True)
-                missing_df = self.get_df_from_remote(symbol, new_start_date, end_date, source)
-                print(f'{symbol}: Fetched {missing_df.shape[0]} dates', flush=True)
-                if (missing_df.size > 0):
-                    df = df.combine_first(missing_df)
-                    # For some reason combine_first is reversing the order
-                    if (missing_df.index.is_monotonic_increasing):
-                        df = df.iloc[::-1]
-
-        # 2. If not available in DB, get data from remote:
-        # - Either The df is empty and does not contain a 'Date' column. 
-        # - Or the Symbol could not be found in the database at all.
+        always need to fetch everything anew. Only dates after the last stored date are
+        fetched and appended, stored history is never rewritten.\n
+        Returns the stored prices between start_date and end_date, latest date first."""
+        with report.timer('get_df', source, symbol):
+            prefetched_start_date, prefetched_end_date, df = self.prefetched.pop(symbol, (None, None, None))
+            if (not df is None and prefetched_start_date == start_date and prefetched_end_date == end_date):
+                report.count('db_hits', source=source, symbol=symbol)
+                return df
+            return self.get_df_from_db_or_remote(symbol, start_date, end_date, source)
+
+    def get_df_from_db_or_remote(self, symbol, start_date, end_date, source):
+        logger.debug(f'{symbol}: Getting data. Start: {start_date}. End: {end_date}. Source: {source}')
+
+        # 1. Look up the last stored date. Symbols which are already current need no remote request.
+        last_date = self.get_last_dates([symbol]).get(symbol)
+        if (last_date is None and symbol in self.updated):
+            logger.debug(f'{symbol}: Not available from remote.')
+            return pd.DataFrame()
+        elif (last_date is None):
+            logger.info(f'{symbol}: New symbol. Retrieving complete series from remote.')
+            report.count('db_misses', source=source, symbol=symbol)
+            self.append_to_db(symbol, self.get_due_df_from_remote(symbol, start_date, end_date, source, None), None)
+        elif (symbol in self.updated or self.is_current(last_date, end_date, source)):
+            logger.debug(f'{symbol}: Up to date. Last date in DB: {last_date:{db_date_format}}')
+            report.count('db_hits', source=source, symbol=symbol)
+            df = self.get_df_from_cache(symbol, start_date, end_date, last_date)
+            if (not df is None):
+                report.count('cache_hits', source=source, symbol=symbol)
+                return df
         else:
-            print(f'{symbol}: Retrieving complete series from remote.', flush=True)
-            df = self.get_df_from_remote(symbol, start_date, end_date, source)
-            if (df.index.is_monotonic_increasing):
-                df = df.iloc[::-1]
-            df_is_new = True
-
-        # 3. Write new values to DB
-        # Only write if not yet in DB
-        if (not df_is_new and not missing_df is None and missing_df.size > 0):
-            print (f'{symbol}: Known symbol. Updating stored values with missing dates.', flush=True)
-            missing_df = df.drop(columns=['Open', 'High', 'Low', 'Change', 'Turnover', 'TradedVolume', 'LastPriceoftheDay', 'DailyTradedUnits', 'DailyTurnover', 'open', 'high', 'low', 'volume'], errors='ignore')
-            self.write_to_db(missing_df, symbol)
-        elif (df_is_new and not df is None and df.size > 0):
-            print (f'{symbol}: New symbol. Need to store everything.', flush=True)
-            df = df.drop(columns=['Open', 'High', 'Low', 'Change', 'Turnover', 'TradedVolume', 'LastPriceoftheDay', 'DailyTradedUnits', 'DailyTurnover', 'open', 'high', 'low', 'volume'], errors='ignore')
-            self.write_to_db(df, symbol)
+            # 2. Fetch exactly the range after the last stored date and append it
+            missing_start_date = datetime.strftime(last_date + timedelta(days=1), db_date_format)
+            logger.debug(f'{symbol}: Last date in DB: {last_date:{db_date_format}}. Fetching values since {missing_start_date}.')
+            report.count('db_hits', source=source, symbol=symbol)
+            self.append_to_db(symbol, self.get_due_df_from_remote(symbol, missing_start_date, end_date, source, last_date), last_date)
 
+        # 3. Read only the requested window, already in the expected order
+        df = self.get_df_from_db(symbol, start_date, end_date)
+        if (df is None):
+            return pd.DataFrame()
         return df
 
+    def get_due_df_from_remote(self, symbol, start_date, end_date, source, last_date):
+        """Same as get_df_from_remote, but returns an empty frame without requesting symbols
+        the fetch cache does not consider due, and records the outcome. last_date is the last stored date of the symbol."""
+        if (not self.fetch_cache.is_due(source, symbol, start_date, end_date)):
+            logger.debug(f'{symbol}: Skipping remote request, fetched recently or failing remotely')
+            report.count('fetch_cache_skips', source=source, symbol=symbol)
+            return pd.DataFrame()
+        df = self.request_remote(symbol, start_date, end_date, source)
+        if (df is None):
+            return pd.DataFrame()
+        self.record_fetches({symbol: df}, {symbol: start_date}, end_date, source, {symbol: last_date})
+        self.write_fetch_log()
+        return df
+
+    def append_to_db(self, symbol, df, last_date):
+        """Writes the rows of a freshly fetched pandas.DataFrame which are newer than last_date."""
+        df = self.get_new_rows(df, last_date)
+        logger.debug(f'{symbol}: Fetched {df.shape[0]} new dates')
+        self.write_to_db(df, symbol)
+
+    def get_new_rows(self, df, last_date):
+        """Returns the rows of a pandas.DataFrame which are newer than last_date (all rows if None)."""
+        if (df.size == 0 or last_date is None):
+            return df
+        return df[pd.to_datetime(df.index) > last_date]
+
+    def is_current(self, last_date, end_date, source):
+        """A symbol is current if it has the closing price of the last trading day of its exchange before end_date.
+        The closing price of end_date itself is usually not published yet."""
+        return last_date >= trading_calendar.get_previous_trading_day(source, end_date)
+
     def sql_friendly_symbol(self, symbol):
         return symbol.replace('/', '')
 
     def latest_date(self, df):
-        return df['Date'].get_values()[0]
\ No newline at end of file
+        return df['Date'].get_values()[0]
+
+def is_source_error(error):
+    """Returns True if a failed remote request says nothing about the requested symbols: the source
+    could not be reached, timed out, kept failing (HTTP 429 or 5xx) or is blocked by its circuit breaker."""
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+# DataAccess objects per DB file name, shared by all threads
+stores = {}
+stores_lock = threading.Lock()
+
+def get_data_access(file_name):
+    """Returns the shared DataAccess of the given DB file name."""
+    with stores_lock:
+        if (file_name not in stores):
+            stores[file_name] = DataAccess(file_name)
+        return stores[file_name]
@@ -0,0 +1,73 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+class DatabaseWriter:
+    """
+    Runs all writes to one database on a single thread, so concurrent writers never wait for
+    SQLite's write lock. Writes submitted while a transaction runs are committed together in the
+    next one. If that transaction fails, its writes are run again one by one, so only the failing
+    write fails.
+    \n
+    Constructor Params:
+    - database -- sqlalchemy engine of the database
+    - name     -- name of the writer thread
+    """
+
+    def __init__(self, database, name='DatabaseWriter'):
+        self.database = database
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, write, wait=True):
+        """
+        Queues write, a function taking an sqlalchemy connection inside a transaction.
+        With wait=True returns the result of write once it is committed and raises its exception if it failed.
+        Otherwise returns a concurrent.futures.Future of it, failures are logged.
+        """
+        future = Future()
+        self.queue.put((write, future))
+        if (wait):
+            return future.result()
+        return future
+
+    def flush(self):
+        """Waits until all writes submitted so far are committed."""
+        self.submit(lambda connection: None)
+
+    def run(self):
+        while (True):
+            pending = [self.queue.get()]
+            while (not self.queue.empty()):
+                pending.append(self.queue.get())
+            stop = None in pending
+            pending = [write for write in pending if not write is None]
+            if (len(pending) > 0):
+                self.write(pending)
+            if (stop):
+                return
+
+    def write(self, pending):
+        try:
+            with self.database.begin() as connection:
+                results = [write(connection) for write, _ in pending]
+        except Exception as e:
+            if (len(pending) > 1):
+                logger.debug(f'Transaction of {len(pending)} writes failed, writing them one by one')
+                for write in pending:
+                    self.write([write])
+                return
+            logger.exception('Write failed')
+            pending[0][1].set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+
+    def close(self):
+        """Commits the queued writes and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
@@ -4,23 +4,57 @@ from email.utils import make_msgid
 import mimetypes
 import config
 
+# Seconds to wait for the SMTP server
+smtp_timeout = 60
+
 class Emailer:
     """
     This class is able to send emails via a predefined smtp server
     """
 
     def __init__(self):
-        self.port = 587
+        self.port = config.email_port
+        self.starttls = config.email_starttls
         self.smtp_server = config.email_smtp_server
         self.sender_email = config.email_sender
         self.password = config.email_password
 
     def send_mail(self, receiver, subject, text, image=None):
-        context = ssl.create_default_context()
+        self.send_message([receiver], self.create_message(receiver, subject, text, image))
+
+    def send_mails(self, receivers, subject, text, image=None):
+        """Renders the mail once and sends it to all receivers over a single SMTP session."""
+        self.send_message(receivers, self.create_message(None, subject, text, image))
+
+    def send_message(self, receivers, message):
+        """Sends a rendered message to every receiver, each with its own To header, over a single SMTP session."""
+        with self.connect() as server:
+            self.send_over(server, receivers, message)
+
+    def send_over(self, server, receivers, message):
+        """Sends a rendered message to every receiver over an open SMTP session."""
+        for receiver in receivers:
+            del message["To"]
+            message["To"] = receiver
+            server.send_message(message)
+
+    def connect(self):
+        """Opens an SMTP session. TLS and login are skipped if not configured, e.g. for a local SMTP server."""
+        server = smtplib.SMTP(self.smtp_server, self.port, timeout=smtp_timeout)
+        if (self.starttls):
+            server.starttls(context=ssl.create_default_context())
+        if (self.password != ''):
+            server.login(self.sender_email, self.password)
+        return server
+
+    def create_message(self, receiver, subject, text, image=None):
+        """Renders the mail with the text and, if given, the image embedded into the html part.
+        The image is a file name or the bytes of a png. The To header is left out if receiver is None."""
         message = EmailMessage()
         message["Subject"] = subject
         message["From"] = self.sender_email
-        message["To"] = receiver
+        if (not receiver is None):
+            message["To"] = receiver
         message.set_content(text)
 
         text = text.replace('\n', '<br />')
@@ -37,13 +71,12 @@ class Emailer:
                 </body>
             </html>
             """.format(text=text, image_cid=image_cid[1:-1]), subtype='html')
-            with open('./data/output.png', 'rb') as img:
-                maintype, subtype = mimetypes.guess_type(img.name)[0].split('/')
-                message.get_payload()[1].add_related(img.read(), maintype=maintype, subtype=subtype, cid=image_cid)
+            if (isinstance(image, bytes)):
+                maintype, subtype = 'image', 'png'
+            else:
+                maintype, subtype = mimetypes.guess_type(image)[0].split('/')
+                with open(image, 'rb') as img:
+                    image = img.read()
+            message.get_payload()[1].add_related(image, maintype=maintype, subtype=subtype, cid=image_cid)
 
-        with smtplib.SMTP(self.smtp_server, self.port) as server:
-            server.starttls(context=context)
-            server.login(self.sender_email, self.password)
-            #server.sendmail(self.sender_email, receiver, message.as_string())
-            server.send_message(message)
-            server.quit()
\ No newline at end of file
+        return message
\ No newline at end of file
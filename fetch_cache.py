@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime
+
+class FetchCache:
+    """
+    Remembers the outcome of the remote requests per (source, symbol), so requests which cannot
+    return anything new are not repeated. A successful fetch of a date range is not requested again
+    within success_ttl. A symbol without stored prices the source answered with no prices for is checked
+    again after failure_recheck, the interval doubles with every further failure up to max_recheck.
+    A success resets it. Requests which failed because of the source itself are not recorded.
+    The fetch workers of a source share one FetchCache, DataAccess stores it in the fetch_log table.
+    \n
+    Constructor Params:
+    - success_ttl     -- datetime.timedelta during which a fetched date range is not fetched again
+    - failure_recheck -- datetime.timedelta after which a failed symbol is requested again
+    - max_recheck     -- datetime.timedelta the recheck interval of failed symbols grows to at most
+    - records         -- rows of the fetch_log table to start with, see get_changes
+    """
+
+    def __init__(self, success_ttl, failure_recheck, max_recheck, records=()):
+        self.success_ttl = success_ttl
+        self.failure_recheck = failure_recheck
+        self.max_recheck = max_recheck
+        self.lock = threading.Lock()
+        # (source, symbol) -> record as in the fetch_log table
+        self.records = {}
+        self.changed = set()
+        self.load(records)
+
+    def load(self, records):
+        """Adds rows of the fetch_log table. Symbols already recorded keep their record."""
+        with self.lock:
+            for record in records:
+                self.records.setdefault((record['source'], record['symbol']), record)
+
+    def is_due(self, source, symbol, start_date, end_date, now=None):
+        """Returns True if the symbol should be requested for the date range (yyyy-mm-dd)."""
+        now = now or datetime.now()
+        with self.lock:
+            record = self.records.get((source, symbol))
+        if (record is None):
+            return True
+        if (record['failures'] > 0):
+            return now >= record['next_check']
+        return (record['start_date'], record['end_date']) != (start_date, end_date) or now >= record['checked_at'] + self.success_ttl
+
+    def record(self, source, symbol, start_date, end_date, succeeded, now=None):
+        """Records the answer of the source to a request, succeeded is False if it has no prices for a symbol it should have."""
+        now = now or datetime.now()
+        with self.lock:
+            record = self.records.get((source, symbol))
+            failures = 0 if succeeded or record is None else record['failures']
+            if (not succeeded):
+                failures += 1
+            recheck = min(self.failure_recheck * 2 ** (failures - 1), self.max_recheck) if failures > 0 else self.success_ttl
+            self.records[(source, symbol)] = {'source': source, 'symbol': symbol, 'start_date': start_date,
+                'end_date': end_date, 'checked_at': now, 'failures': failures, 'next_check': now + recheck}
+            self.changed.add((source, symbol))
+
+    def get_changes(self):
+        """Returns the records changed since the last call, to be stored."""
+        with self.lock:
+            changes = [self.records[key] for key in self.changed]
+            self.changed = set()
+        return changes
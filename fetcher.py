@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """
+    Limits how many remote requests per second are issued against one source.
+    A single instance is shared by all fetch workers of that source.
+    \n
+    Constructor Params:
+    - requests_per_second -- allowed request rate, 0 disables limiting
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        """Blocks the calling thread until it is allowed to issue the next request."""
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(source):
+    """Returns the RateLimiter shared by all requests against the given remote source."""
+    with rate_limiters_lock:
+        if (source not in rate_limiters):
+            rate_limiters[source] = RateLimiter(config.fetch_requests_per_second(source))
+        return rate_limiters[source]
+
+class FetchScheduler:
+    """
+    Fans out per-symbol work for one remote source across a bounded thread pool.
+    The pool size is configured per source in config.ini ([fetch]), the requests are throttled
+    by the RateLimiter of the source, see get_rate_limiter.
+    \n
+    Constructor Params:
+    - source -- remote source the scheduled symbols are fetched from
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.workers = config.fetch_workers(source)
+
+    def map(self, function, items):
+        """Calls function for every item on the worker pool. Returns the results in input order."""
+        logger.info(f'{self.source}: Scheduling {len(items)} tasks on {self.workers} workers')
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.source) as executor:
+            return list(executor.map(function, items))
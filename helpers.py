@@ -1,9 +1,28 @@
+import logging
 from datetime import datetime, timedelta
 
+import config
+
 def get_date_in_the_past(days):
     '''Returns date x days in the past from today'''
     return datetime.strftime(datetime.now() - timedelta(days), '%Y-%m-%d')
 
 def get_date_object(date_string):
     '''Returns datetime object representation of the given date in the format yyyy-mm-dd'''
-    return datetime.strptime(date_string, '%Y-%m-%d')
\ No newline at end of file
+    return datetime.strptime(date_string, '%Y-%m-%d')
+
+def get_pyplot(headless=True):
+    '''Imports matplotlib.pyplot on first use. Headless plots use the non-interactive Agg backend, which needs no display.'''
+    import matplotlib
+    if (headless):
+        matplotlib.use('Agg')
+    from matplotlib import pyplot
+    from pandas.plotting import register_matplotlib_converters
+    register_matplotlib_converters()
+    return pyplot
+
+def setup_logging(level=None, process_name=False):
+    '''Configures the log output of an entry point, level defaults to config.log_level.
+    process_name also names the process of every line, for processes running side by side.'''
+    thread = '[%(processName)s %(threadName)s]' if process_name else '[%(threadName)s]'
+    logging.basicConfig(level=config.log_level if level is None else level, format=f'%(asctime)s %(levelname)s {thread} %(name)s: %(message)s')
@@ -1,26 +1,93 @@
+import io
+import os
+
 import pandas as pd
-import matplotlib.pyplot as plot
+
+import helpers
 
 class History:
+    """
+    Daily counts of the symbols below and above their thresholds, kept in an append-only csv file.
+    A new day is appended as one line, a repeated day as another line which replaces the earlier
+    one when read. The file is parsed once per process and then kept in memory, the chart of it
+    is only rendered again after the counts changed.
+    """
+
     def __init__(self):
         self.file = './data/history.csv'
         self.delimiter = '\t'
+        self.columns = ['below', 'above', 'total']
+        self.df = None
+        # Size of the file when it was read or last appended to, detects writes of other processes
+        self.file_size = None
+        # File size of the counts the cached chart shows and its png bytes
+        self.plot_size = None
+        self.plot_png = None
 
     def read(self):
-        df = pd.read_csv(self.file, sep=self.delimiter, index_col='Date')  
-        return df
+        if (self.df is None or self.file_size != self.get_file_size()):
+            df = pd.read_csv(self.file, sep=self.delimiter, index_col='Date')
+            self.df = df[~df.index.duplicated(keep='last')].sort_index()
+            self.file_size = self.get_file_size()
+        return self.df
+
+    def get_file_size(self):
+        return os.path.getsize(self.file) if os.path.exists(self.file) else 0
 
     def add_date(self, date, below, above, total):
+        if (self.get_file_size() == 0):
+            with open(self.file, 'w', encoding='utf-8') as history_file:
+                history_file.write(self.delimiter.join(['Date'] + self.columns) + '\n')
         df = self.read()
+        if (date in df.index and list(df.loc[date]) == [below, above, total]):
+            return
+        with open(self.file, 'a', encoding='utf-8') as history_file:
+            history_file.write(self.delimiter.join(str(value) for value in [date, below, above, total]) + '\n')
         df.loc[date] = [below, above, total]
-        df.to_csv(self.file, sep=self.delimiter, encoding='utf-8', header='true')
+        self.df = df.sort_index()
+        self.file_size = self.get_file_size()
 
     def show_plot(self):
-        df = self.read()
-        df.plot.area(stacked=False)
+        plot = helpers.get_pyplot(headless=False)
+        self.plot(plot)
         plot.show()
 
     def save_plot(self, output_file):
+        """
+        Writes the chart to output_file and returns its png bytes. The chart of unchanged counts is not
+        rendered again, an output_file written after the last change of the counts is reused.
+        """
+        self.read()
+        if (self.plot_size != self.file_size and self.is_up_to_date(output_file)):
+            with open(output_file, 'rb') as png_file:
+                self.plot_png = png_file.read()
+            self.plot_size = self.file_size
+        if (self.plot_size != self.file_size):
+            plot = helpers.get_pyplot()
+            figure = self.plot(plot)
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format='png')
+            # Long running processes save a plot per evaluation
+            plot.close(figure)
+            self.plot_size = self.file_size
+            self.plot_png = buffer.getvalue()
+            with open(output_file, 'wb') as png_file:
+                png_file.write(self.plot_png)
+        return self.plot_png
+
+    def is_up_to_date(self, output_file):
+        return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(self.file)
+
+    def plot(self, plot):
+        """Draws the counts as overlapping areas on a date axis and returns the figure."""
         df = self.read()
-        df.plot.area(stacked=False)
-        plot.savefig(output_file)
\ No newline at end of file
+        figure, axes = plot.subplots()
+        dates = pd.to_datetime(df.index).to_numpy()
+        for column in df.columns:
+            values = df[column].to_numpy(dtype=float)
+            line, = axes.plot(dates, values, label=column)
+            axes.fill_between(dates, values, alpha=0.5, color=line.get_color())
+        axes.set_xlabel(df.index.name)
+        axes.legend()
+        figure.autofmt_xdate()
+        return figure
@@ -0,0 +1,143 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import fetcher
+from instrumentation import report
+
+logger = logging.getLogger(__name__)
+
+class SourceUnavailableError(requests.exceptions.ConnectionError):
+    """Raised if a source still answers with 429 or 5xx after all retries."""
+
+class CircuitOpenError(SourceUnavailableError):
+    """Raised instead of a request while the circuit breaker of a source is open."""
+
+class CircuitBreaker:
+    """
+    Stops requests against a source which keeps failing. After failure_threshold consecutive
+    failures the circuit opens and requests fail immediately. After cooldown seconds a single
+    trial request is let through: success closes the circuit, failure opens it again.
+    \n
+    Constructor Params:
+    - failure_threshold -- consecutive failures which open the circuit
+    - cooldown          -- seconds the circuit stays open before a trial request
+    """
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        """Returns True if a request may be sent now."""
+        with self.lock:
+            if (self.opened_at is None):
+                return True
+            if (self.trial_running or time.monotonic() - self.opened_at < self.cooldown):
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if (self.trial_running or self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+class RetryingSession(requests.Session):
+    """
+    HTTP session shared by all fetch workers of one remote source. Keeps connections alive in a
+    pool sized to the worker count, retries timeouts, connection errors, 429 and 5xx responses with
+    exponential backoff and jitter, and guards the source with a CircuitBreaker. Retries wait for the
+    fetcher.RateLimiter of the source like the first request does.
+    \n
+    Constructor Params:
+    - source -- remote source the session is used for
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self.retries = config.http_retries
+        self.backoff = config.http_backoff
+        self.max_backoff = config.http_max_backoff
+        self.timeout = config.http_timeout
+        self.breaker = CircuitBreaker(config.http_breaker_failures, config.http_breaker_cooldown)
+        self.rate_limiter = fetcher.get_rate_limiter(source)
+        pool_size = config.fetch_workers(source)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        response = None
+        for attempt in range(self.retries + 1):
+            if (not self.breaker.allow()):
+                report.count('circuit_open', source=self.source)
+                raise CircuitOpenError(f'{self.source} is unavailable, not sending requests for now')
+            try:
+                response = super().request(method, url, **kwargs)
+                error = None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response = None
+                error = e
+            except BaseException:
+                # Not retried, but a failure all the same: a trial request of the breaker must always be resolved
+                self.breaker.record_failure()
+                raise
+            if (not response is None and not self.is_retryable(response)):
+                # Also 4xx like unknown symbols: the source itself is fine
+                self.breaker.record_success()
+                return response
+            self.breaker.record_failure()
+            if (attempt == self.retries):
+                break
+            delay = self.get_delay(attempt, response)
+            cause = error if response is None else f'HTTP {response.status_code}'
+            logger.info(f'{self.source}: Request failed ({cause}). Retrying in {delay:.1f} s.')
+            report.count('http_retries', source=self.source)
+            time.sleep(delay)
+            # The caller waited for the first attempt only
+            self.rate_limiter.wait()
+        if (response is None):
+            raise error
+        raise SourceUnavailableError(f'{self.source} answered HTTP {response.status_code} {self.retries + 1} times', response=response)
+
+    def is_retryable(self, response):
+        return response.status_code == 429 or response.status_code >= 500
+
+    def get_delay(self, attempt, response):
+        """Exponential backoff with full jitter. A Retry-After header of the response takes precedence."""
+        if (not response is None):
+            try:
+                return min(float(response.headers['Retry-After']), self.max_backoff)
+            except (KeyError, ValueError):
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+def get_session(source):
+    """Returns the shared RetryingSession of the given remote source."""
+    with sessions_lock:
+        if (source not in sessions):
+            sessions[source] = RetryingSession(source)
+        return sessions[source]
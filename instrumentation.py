@@ -0,0 +1,111 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class RunReport:
+    """
+    Collects timings (seconds) and counters of one run per phase, per source and per symbol
+    and writes them as JSON lines. Safe to use from all worker threads.
+    \n
+    Records without symbol and source describe the run, records with a source but no symbol
+    describe a phase of that source. Per-source totals of the symbol records are added on write.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drops all records and starts a new run."""
+        with self.lock:
+            self.run = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
+            self.timings = defaultdict(lambda: defaultdict(float))
+            self.counters = defaultdict(lambda: defaultdict(int))
+            # Symbols are not always recorded together with their source, so remember it once known
+            self.sources = {}
+
+    def key(self, source, symbol):
+        if (not source is None and not symbol is None):
+            self.sources[symbol] = source
+        return (None, symbol) if not symbol is None else (source, None)
+
+    def add_time(self, name, seconds, source=None, symbol=None):
+        with self.lock:
+            self.timings[self.key(source, symbol)][name] += seconds
+
+    def count(self, name, value=1, source=None, symbol=None):
+        with self.lock:
+            self.counters[self.key(source, symbol)][name] += value
+
+    @contextmanager
+    def timer(self, name, source=None, symbol=None):
+        """Context manager which adds the wall time of its block to the named timing."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, source, symbol)
+
+    def merge(self, other):
+        """Adds the timings and counters of another RunReport, e.g. of another process."""
+        with self.lock:
+            for key, timings in other.timings.items():
+                for name, seconds in timings.items():
+                    self.timings[key][name] += seconds
+            for key, counters in other.counters.items():
+                for name, value in counters.items():
+                    self.counters[key][name] += value
+            self.sources.update(other.sources)
+
+    def __getstate__(self):
+        # Sent to other processes without lock
+        with self.lock:
+            return {'run': self.run, 'sources': dict(self.sources),
+                'timings': {key: dict(timings) for key, timings in self.timings.items()},
+                'counters': {key: dict(counters) for key, counters in self.counters.items()}}
+
+    def __setstate__(self, state):
+        self.lock = threading.Lock()
+        self.run = state['run']
+        self.sources = state['sources']
+        self.timings = defaultdict(lambda: defaultdict(float), {key: defaultdict(float, timings) for key, timings in state['timings'].items()})
+        self.counters = defaultdict(lambda: defaultdict(int), {key: defaultdict(int, counters) for key, counters in state['counters'].items()})
+
+    def get_records(self):
+        """Returns all records as list of dicts, including the per-source totals of the symbol records."""
+        with self.lock:
+            keys = set(self.timings) | set(self.counters)
+            records = {}
+            for key in keys:
+                source, symbol = key
+                if (not symbol is None):
+                    source = self.sources.get(symbol)
+                records[key] = {'run': self.run, 'source': source, 'symbol': symbol,
+                    'timings': dict(self.timings[key]), 'counters': dict(self.counters[key])}
+            for (source, symbol), record in list(records.items()):
+                if (symbol is None or record['source'] is None):
+                    continue
+                total = records.setdefault((record['source'], None),
+                    {'run': self.run, 'source': record['source'], 'symbol': None, 'timings': {}, 'counters': {}})
+                total.setdefault('symbol_totals', {'timings': defaultdict(float), 'counters': defaultdict(int)})
+                for name, value in record['timings'].items():
+                    total['symbol_totals']['timings'][name] += value
+                for name, value in record['counters'].items():
+                    total['symbol_totals']['counters'][name] += value
+        return sorted(records.values(), key=lambda record: (str(record['source']), str(record['symbol'])))
+
+    def write(self, file_name):
+        """Appends all records of this run to a JSON lines file."""
+        records = self.get_records()
+        with open(file_name, 'a') as report_file:
+            for record in records:
+                report_file.write(json.dumps(record) + '\n')
+        logger.info(f'Wrote {len(records)} records to run report {file_name}')
+
+report = RunReport()
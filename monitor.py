@@ -3,61 +3,161 @@ TODO: Add 'web' data access type (web crawler), which also creates pandas datafr
 TODO: Webserver: representation and control of data
 """
 
+import logging
 import threading
 import csv
+import itertools
 import signal, sys, os
+import numpy as np
+import pandas as pd
 
 import config
+import helpers
 import technical_indicators
-from datetime import datetime
+import rules
+from datetime import datetime, timedelta
 from stock import Stock
-from emailer import Emailer
-from data_access import DataAccess
+from notifications import AlarmState, Notifier
+from data_access import get_data_access
+from fetcher import FetchScheduler
 from history import History
+from instrumentation import report
+from alarms import AlarmCollector
+from compute_pool import IndicatorPool
+
+logger = logging.getLogger(__name__)
 
-emailer = Emailer()
-history = History()
 DAYS = 80
 
-# Append and get on arrays are each atomic ops according to python doc,
-# so no synchronization required when accessed from different threads.
-alarms_above = []
-alarms_below = []
+# Created on first use by get_notifier, get_alarm_state and get_history, so processes which only import
+# monitor, like the spawned processes of compute_pool and sharding, start no thread and read no state files
+notifier = None
+alarm_state = None
+history = None
+setup_lock = threading.Lock()
+
+# Alarms of the current evaluation, created by the entry point
+alarms = None
+
+# Number of evaluated stocks per source
+evaluated_stocks = {}
+
+# Process pool for the indicator computation, see config.indicator_processes
+indicator_pool = None
+
+# Alarm rules of config.ini, evaluated on every stock in addition to the RSI thresholds
+alarm_rules = rules.get_rules(config.alarm_rules)
+
+# Universe of every remote source: name of its csv file and DB file
+universes = {'stooq': 'sandp500', 'quandl': 'quandl_fse_stocks', 'iex': 'sandp_top_250'}
 
-fse_stocks = []
-sandp500_stocks = []
-iex_stocks = []
+def get_notifier():
+    global notifier
+    with setup_lock:
+        if (notifier is None):
+            notifier = Notifier(config.email_recepients)
+        return notifier
+
+def close_notifier():
+    """Waits for the queued mails of the notifier if one was created."""
+    if (not notifier is None):
+        notifier.close()
+
+def get_alarm_state():
+    global alarm_state
+    with setup_lock:
+        if (alarm_state is None):
+            alarm_state = AlarmState(config.alarm_state_file, config.alarm_reminder_days)
+        return alarm_state
+
+def get_history():
+    global history
+    with setup_lock:
+        if (history is None):
+            history = History()
+        return history
+
+def create_indicator_pool():
+    """Returns the IndicatorPool of config.indicator_processes, None if there are no processes
+    or the configuration never lets an evaluation use them."""
+    if (config.indicator_processes == 0):
+        return None
+    if (config.incremental_indicators and config.use_database):
+        logger.warning(f'[indicators] processes = {config.indicator_processes} is not used: with incremental = True '
+            'the indicators are advanced from their stored states instead of being computed on the processes')
+        return None
+    if (config.indicator_pool_min_symbols > config.fetch_chunk_size):
+        logger.warning(f'[indicators] processes = {config.indicator_processes} is not used: pool_min_symbols = {config.indicator_pool_min_symbols} '
+            f'is larger than [fetch] chunk_size = {config.fetch_chunk_size}, the most symbols computed at once')
+        return None
+    return IndicatorPool(config.indicator_processes, config.indicator_pool_min_symbols)
 
 def handler(signum, frame):
-    print ('Bye')
+    logger.info('Bye')
     sys.exit()
 
-def send_alarm(alarms_below, alarms_above):
+def send_alarm(alarms, history_date=None, history_counts=None):
+    """Records the counts in the history and sends the alarm mail. history_date and history_counts (below, above, total)
+    are the row of the history, by default today and the counts of alarms."""
     today = datetime.strftime(datetime.now(), '%Y-%m-%d')
-    total_stocks = len(fse_stocks) + len(sandp500_stocks) + len(iex_stocks)
-    history.add_date(today, len(alarms_below), len(alarms_above), total_stocks)
-    history.save_plot(config.history_output_file)
+    total_stocks = sum(evaluated_stocks.values())
+    if (history_counts is None):
+        history_date, history_counts = today, (alarms.below_count, alarms.above_count, total_stocks)
+    with report.timer('history_plot'):
+        get_history().add_date(history_date, *history_counts)
+        chart = get_history().save_plot(config.history_output_file)
+    with report.timer('alarm_assembly'):
+        message = get_alarm_message(today, total_stocks, alarms)
+    logger.info("\n" + message)
+    get_alarm_state().update(alarms.zones, evaluated_stocks.keys())
+    notified = [stock.symbol for stock in alarms.get_below() + alarms.get_above()]
+    for rule, (_, _, kept) in alarms.get_rules().items():
+        notified += [alarms.rule_key(rule, stock.symbol) for stock, _ in kept]
+    if (len(notified) == 0):
+        logger.info('No new alarms, not sending a mail')
+        return
+    subject = "Stock Monitor: Symbols exceeded their thresholds"
+    logger.info(f'Sending alarm mail to {len(config.email_recepients)} recipients')
+    with report.timer('email_render'):
+        get_notifier().notify(subject, message, chart, lambda: get_alarm_state().mark_notified(notified))
+
+def get_alarm_message(today, total_stocks, alarms):
+    alarms_below = alarms.get_below()
+    alarms_above = alarms.get_above()
     message = f'RSI Stockmonitor from {today}.\n'
     message += '\n'
     message += f'Total stocks: {total_stocks}\n'
-    message += f'Stocks below min RSI threshold: {len(alarms_below)} == {get_percentage(total_stocks, len(alarms_below))}%\n'
-    message += f'Stocks above max RSI threshold: {len(alarms_above)} == {get_percentage(total_stocks, len(alarms_above))}%\n'
+    message += f'Stocks below min RSI threshold: {alarms.below_count} == {get_percentage(total_stocks, alarms.below_count)}%\n'
+    message += f'Stocks above max RSI threshold: {alarms.above_count} == {get_percentage(total_stocks, alarms.above_count)}%\n'
     message += '\n'
     for symbol in alarms_below:
         message += get_mail_text(symbol)
+    message += get_omitted_text(alarms.below_count, alarms.below_due, len(alarms_below))
     message += '\n'
     for symbol in alarms_above:
         message += get_mail_text(symbol)
-    print ("\n" + message)
-    subject = "Stock Monitor: Symbols exceeded their thresholds"
-    for recepient in config.email_recepients:
-        print('Sending alarm mail to ' + recepient)
-        emailer.send_mail(recepient, subject, message, config.history_output_file)
+    message += get_omitted_text(alarms.above_count, alarms.above_due, len(alarms_above))
+    for rule, (count, due, kept) in alarms.get_rules().items():
+        message += '\n'
+        message += f'Rule {rule}: {count} == {get_percentage(total_stocks, count)}%\n'
+        for stock, since in kept:
+            message += f'Since: {since}\tSymbol: {stock.name} ({stock.symbol})\n'
+        message += get_omitted_text(count, due, len(kept))
+    return message
+
+def get_omitted_text(count, due, listed):
+    text = ''
+    if (due > listed):
+        text += f'... and {due - listed} more\n'
+    if (count > due):
+        text += f'{count - due} more already notified before\n'
+    return text
 
 def get_mail_text(symbol):
     text = ''
-    text += "RSI: " + str(f'{symbol.get_latest_rsi():2.2f}') + ". "
-    text += f'Exceeded since: {str(symbol.get_rsi_exceeded_since_date())}'
+    text += "RSI: " + str(f'{symbol.last_rsi:2.2f}') + ". "
+    exceeded_since = symbol.get_rsi_exceeded_since_date()
+    text += f'Exceeded since: {"unknown" if exceeded_since is None else exceeded_since}'
     text += f'\tSymbol: {symbol.name} ({symbol.symbol})'
     text += '\n'
     return text
@@ -68,33 +168,73 @@ def get_percentage(total, part):
     return f'{(part/total)*100:2.2f}'
 
 def evaluate_sandp500_stocks():
-    print('Started evaluating STOOQ.com stocks ...', flush=True)
-    data_access = DataAccess('sandp500')
-    global sandp500_stocks
-    sandp500_stocks = evaluate_stocks('stooq', 'sandp500.csv', data_access)
+    logger.info('Started evaluating STOOQ.com stocks ...')
+    scheduler = FetchScheduler('stooq')
+    data_access = get_store('stooq')
+    evaluated_stocks['stooq'] = evaluate_stocks('stooq', f'{universes["stooq"]}.csv', data_access, scheduler)
 
 def evaluate_fse_stocks():
-    print('Started evaluating QUANDL stocks ...', flush=True)
-    data_access = DataAccess('quandl_fse_stocks')
-    global fse_stocks
-    fse_stocks = evaluate_stocks('quandl', 'quandl_fse_stocks.csv', data_access)
+    logger.info('Started evaluating QUANDL stocks ...')
+    scheduler = FetchScheduler('quandl')
+    data_access = get_store('quandl')
+    evaluated_stocks['quandl'] = evaluate_stocks('quandl', f'{universes["quandl"]}.csv', data_access, scheduler)
 
 def evaluate_iex_stocks():
-    print('Started evaluating IEX stocks ...', flush=True)
-    filename = 'sandp_top_250'
+    logger.info('Started evaluating IEX stocks ...')
     os.environ["IEX_API_KEY"] = config.data_iex_api_key
-    data_access = DataAccess(filename)
-    global iex_stocks
-    iex_stocks = evaluate_stocks('iex', f'{filename}.csv', data_access)
+    scheduler = FetchScheduler('iex')
+    data_access = get_store('iex')
+    evaluated_stocks['iex'] = evaluate_stocks('iex', f'{universes["iex"]}.csv', data_access, scheduler)
 
-def evaluate_stocks(remote_source, csv_file, data_access):
-    output_list = []
-    # First create a list of stocks to query
+def get_store(remote_source):
+    """Returns the DataAccess of the source: the one shared by all sources (config.data_database), into which
+    the DB files of the single universes are imported on first use, or the DB file of its universe."""
+    if (config.data_database == ''):
+        return get_data_access(universes[remote_source])
+    store = get_data_access(config.data_database)
+    for file_name in universes.values():
+        store.import_database(file_name)
+    return store
+
+def evaluate_stocks(remote_source, csv_file, data_access, scheduler):
+    """Streams the universe through fetch and evaluation in chunks of config.fetch_chunk_size symbols,
+    so memory stays flat and alarms are collected while the universe is still being read.
+    Returns the number of evaluated stocks."""
+    entries = resolve_thresholds(iter_universe(remote_source, csv_file))
+    return evaluate_entries(remote_source, entries, data_access, scheduler)
+
+def evaluate_entries(remote_source, entries, data_access, scheduler, refresh_cache=True):
+    """Same as evaluate_stocks for an iterable of universe entries (name, symbol, min_rsi, max_rsi).
+    refresh_cache=False leaves the price cache file to the caller, e.g. when several processes share it."""
+    stock_count = 0
+    for chunk in iter_chunks(entries, config.fetch_chunk_size):
+        with report.timer('fetch', remote_source):
+            stocks = create_stocks(remote_source, chunk, data_access, scheduler)
+        with report.timer('rsi_compute', remote_source):
+            evaluate_rsi(stocks, data_access)
+        stock_count += len(stocks)
+        logger.info(f'{remote_source}: Evaluated {stock_count} stocks, {alarms.below_count} below and {alarms.above_count} above thresholds so far')
+    if (refresh_cache):
+        data_access.refresh_cache()
+    report.count('symbols', stock_count, remote_source)
+    return stock_count
+
+def read_universe(remote_source, csv_file, skip_stale=True):
+    """Reads the symbols of a universe csv file. Returns a list of (name, symbol, min_rsi, max_rsi)."""
+    return list(resolve_thresholds(iter_universe(remote_source, csv_file, skip_stale)))
+
+def iter_universe(remote_source, csv_file, skip_stale=True):
+    """Yields (name, symbol) for every row of a universe csv file.
+    With skip_stale, symbols which stopped trading are left out, see get_stale_date."""
+    stale_date = get_stale_date(csv_file) if skip_stale else None
+    stale_symbols = 0
     with open(csv_file, newline='') as csvfile:
         file_reader = csv.reader(csvfile, delimiter=',')
-        # Skip the csv header
-        next(file_reader)
+        header = next(file_reader)
         for row in file_reader:
+            if (not stale_date is None and row[header.index('to_date')] < stale_date):
+                stale_symbols += 1
+                continue
             name = row[1]
             if remote_source == 'quandl':
                 symbol = 'FSE/' + row[0]
@@ -102,46 +242,186 @@ def evaluate_stocks(remote_source, csv_file, data_access):
                 symbol = row[0] + '.US'
             elif remote_source == 'iex':
                 symbol = row[0]
-            min_rsi = config.default_min_rsi
-            max_rsi = config.default_max_rsi
-            try:
-                min_rsi = config.custom_rsi(symbol)[0]
-                max_rsi = config.custom_rsi(symbol)[1]
-                print(f'{symbol}: Using custom RSI values ({min_rsi}, {max_rsi})', flush=True)
-            except KeyError:
-                print(f'{symbol}: Using default values for RSI thresholds for', flush=True)
-            stock = Stock(DAYS, name, symbol, data_access, remote_source, min_rsi, max_rsi)
-            output_list.append(stock)
-
-    # Calculate RSI values for all stocks
-    for stock in output_list:
-        last_rsi = stock.get_latest_rsi()
-        print(f'RSI for {stock.symbol}: {str(last_rsi)} \n', flush=True)
-        if (last_rsi > 0):
-            if (last_rsi < stock.min_rsi):
-                alarms_below.append(stock)
-            if (last_rsi > stock.max_rsi):
-                alarms_above.append(stock)
-        #indicators_to_plot = [technical_indicators.Indicators.EMA10, technical_indicators.Indicators.SMA10]
-        #stock.draw_plot(indicators_to_plot)
-
-    return output_list
-
-signal.signal(signal.SIGINT, handler)
-
-iex_thread = threading.Thread(target=evaluate_iex_stocks)
-iex_thread.start()
-
-fse_thread = threading.Thread(target=evaluate_fse_stocks)
-fse_thread.start()
-
-#sandp500_thread = threading.Thread(target=evaluate_sandp500_stocks)
-#sandp500_thread.start()
-
-iex_thread.join()
-fse_thread.join()
-#sandp500_thread.join()
-
-alarms_below = sorted(alarms_below, key=lambda stock: stock.last_rsi)
-alarms_above = sorted(alarms_above, key=lambda stock: stock.last_rsi)
-send_alarm(alarms_below, alarms_above)
\ No newline at end of file
+            yield name, symbol
+    if (stale_symbols > 0):
+        logger.info(f'{remote_source}: Skipped {stale_symbols} symbols without prices since {stale_date}')
+        report.count('stale_symbols', stale_symbols, remote_source)
+
+def get_stale_date(csv_file):
+    """Returns the date (yyyy-mm-dd) before which the last price of a symbol of the universe file (to_date column)
+    marks it as no longer traded: config.fetch_stale_days before the newest refreshed_at of the file.
+    Returns None if the file has no such columns or stale symbols are evaluated."""
+    if (config.fetch_stale_days < 0):
+        return None
+    with open(csv_file, newline='') as csvfile:
+        file_reader = csv.reader(csvfile, delimiter=',')
+        header = next(file_reader)
+        if ('refreshed_at' not in header or 'to_date' not in header):
+            return None
+        refreshed_at = max((row[header.index('refreshed_at')][:10] for row in file_reader), default=None)
+    if (refreshed_at is None):
+        return None
+    return datetime.strftime(datetime.strptime(refreshed_at, '%Y-%m-%d') - timedelta(days=config.fetch_stale_days), '%Y-%m-%d')
+
+def resolve_thresholds(universe):
+    """Yields (name, symbol, min_rsi, max_rsi) for every (name, symbol)."""
+    for name, symbol in universe:
+        min_rsi = config.default_min_rsi
+        max_rsi = config.default_max_rsi
+        try:
+            min_rsi, max_rsi = config.custom_rsi(symbol)
+            logger.debug(f'{symbol}: Using custom RSI values ({min_rsi}, {max_rsi})')
+        except KeyError:
+            logger.debug(f'{symbol}: Using default values for RSI thresholds')
+        yield name, symbol, min_rsi, max_rsi
+
+def iter_chunks(iterable, size):
+    """Yields lists of up to size consecutive items."""
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while (len(chunk) > 0):
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+def create_stocks(remote_source, entries, data_access, scheduler):
+    """Creates the Stock of every universe entry, which fetches its data."""
+    if (config.use_database):
+        # Fetch all missing dates with batched requests first, the stocks then read from the DB
+        symbols = [symbol for _, symbol, _, _ in entries]
+        data_access.update_symbols(symbols, helpers.get_date_in_the_past(DAYS), Stock.today, remote_source, scheduler)
+    # Fetch all stocks concurrently, bounded by the per-source worker pool and rate limit
+    # Each worker holds a single price frame at a time, the stocks keep only their closing prices
+    def create_stock(entry):
+        name, symbol, min_rsi, max_rsi = entry
+        stock = Stock(DAYS, name, symbol, data_access, remote_source, min_rsi, max_rsi)
+        stock.load_closing_prices()
+        return stock
+    return scheduler.map(create_stock, entries)
+
+def evaluate_rsi(stocks, data_access):
+    """Computes the indicators of all stocks in one vectorized pass and collects the stocks
+    exceeding their thresholds into the alarm lists."""
+    closings = {}
+    for stock in stocks:
+        if (stock.closings is None):
+            logger.debug(f'{stock.symbol}: Not enough data to calculate RSI')
+            report.count('no_data', source=stock.source, symbol=stock.symbol)
+            continue
+        closings[stock.symbol] = stock.closings
+    if (len(closings) == 0):
+        return
+    candidates = [stock for stock in stocks if stock.symbol in closings]
+    if (config.incremental_indicators and config.use_database):
+        indicators = None
+        frame = pd.DataFrame(closings)
+        last_rows = frame.index.get_indexer([stock.get_last_date() for stock in candidates])
+        states = advance_indicator_states(frame, last_rows, data_access)
+        latest_rsi = states.get_values(technical_indicators.Indicators.RSI14)
+        latest_rsi[last_rows < 0] = np.nan
+    else:
+        indicators = compute_indicators(pd.DataFrame(closings))
+        latest_rsi = get_latest_rsi(candidates, indicators)
+    min_rsi = np.array([stock.min_rsi for stock in candidates], dtype=float)
+    max_rsi = np.array([stock.max_rsi for stock in candidates], dtype=float)
+
+    has_rsi = latest_rsi > 0
+    below = has_rsi & (latest_rsi < min_rsi)
+    above = has_rsi & (latest_rsi > max_rsi)
+    alarmed = np.flatnonzero(below | above)
+    # The mail report needs the RSI history of alarmed stocks, the rules the indicators of all stocks
+    if (indicators is None and (len(alarmed) > 0 or len(alarm_rules) > 0)):
+        # From the states, so exceeded since dates and rules see the values the alarms were raised on
+        indicators = get_state_indicators(frame, states, last_rows)
+    if (len(alarmed) > 0):
+        set_exceeded_since([candidates[index] for index in alarmed], indicators, below[alarmed])
+    if (len(alarm_rules) > 0):
+        evaluate_rules(candidates, closings, indicators)
+    for index, stock in enumerate(candidates):
+        stock.last_rsi = latest_rsi[index] if has_rsi[index] else -1
+        if (below[index]):
+            alarms.add_below(stock)
+        if (above[index]):
+            alarms.add_above(stock)
+        # Only the summary is needed from here on
+        stock.release()
+
+def set_exceeded_since(stocks, indicators, below):
+    """Sets the date since when every stock has been on the side of its thresholds it is on at its latest date.
+    below is a boolean array, True for the stocks below their min RSI, False for those above their max RSI."""
+    rsi = indicators['RSI14'][[stock.symbol for stock in stocks]]
+    min_rsi = np.array([stock.min_rsi for stock in stocks], dtype=float)
+    max_rsi = np.array([stock.max_rsi for stock in stocks], dtype=float)
+    with np.errstate(invalid='ignore'):
+        exceeded = np.where(below, rsi.to_numpy() < min_rsi, rsi.to_numpy() > max_rsi)
+    starts, _ = rules.get_streaks(exceeded, rsi.index.get_indexer([stock.get_last_date() for stock in stocks]))
+    for stock, start in zip(stocks, starts):
+        stock.exceeded_since = datetime.strftime(rsi.index[start], '%Y-%m-%d') if start >= 0 else None
+
+def evaluate_rules(stocks, closings, indicators):
+    """Evaluates the alarm rules on all stocks at once and collects the alarming ones."""
+    frame = pd.DataFrame({stock.symbol: closings[stock.symbol] for stock in stocks})
+    operands = rules.get_operands(indicators, frame, [stock.min_rsi for stock in stocks], [stock.max_rsi for stock in stocks])
+    last_rows = frame.index.get_indexer([stock.get_last_date() for stock in stocks])
+    for rule in alarm_rules:
+        alarming, starts = rule.evaluate(operands, last_rows)
+        for index in np.flatnonzero(alarming):
+            alarms.add_rule(rule.name, stocks[index], datetime.strftime(frame.index[starts[index]], '%Y-%m-%d'))
+
+def compute_indicators(closings):
+    """Computes all indicators of a wide price frame, on the process pool if there is one."""
+    if (indicator_pool is None):
+        return technical_indicators.compute_indicators(closings)
+    return indicator_pool.compute_indicators(closings)
+
+def get_latest_rsi(stocks, indicators):
+    """Returns the latest RSI of every stock from a wide result of technical_indicators.compute_indicators."""
+    # The latest RSI of a stock is the one at its most recent price, not the forward filled end of the range
+    rsi = indicators['RSI14'][[stock.symbol for stock in stocks]]
+    last_rows = rsi.index.get_indexer([stock.get_last_date() for stock in stocks])
+    latest_rsi = rsi.to_numpy()[last_rows, np.arange(len(stocks))]
+    latest_rsi[last_rows < 0] = np.nan
+    return latest_rsi
+
+def advance_indicator_states(closings, last_rows, data_access):
+    """Advances the stored indicator states of all symbols of a wide price frame by their new prices up to
+    their row in last_rows, all symbols at once, and stores the changed ones.
+    Returns the technical_indicators.IndicatorStates."""
+    states = data_access.get_indicator_states(list(closings.columns))
+    changed = states.advance(closings.to_numpy(dtype=float), closings.index, last_rows)
+    data_access.write_indicator_states(states, changed)
+    return states
+
+def get_state_indicators(closings, states, last_rows):
+    """Returns the indicators of all symbols of a wide price frame like compute_indicators, taken from their
+    technical_indicators.IndicatorStates instead of being computed over the evaluated window only."""
+    history = states.get_history(closings.to_numpy(dtype=float), last_rows)
+    return pd.concat({name: pd.DataFrame(values, index=closings.index, columns=closings.columns) for name, values in history.items()}, axis=1)
+
+def main():
+    helpers.setup_logging()
+    signal.signal(signal.SIGINT, handler)
+    global indicator_pool, alarms
+    alarms = AlarmCollector(config.alarm_report_top, get_alarm_state().is_due)
+    indicator_pool = create_indicator_pool()
+
+    iex_thread = threading.Thread(target=evaluate_iex_stocks)
+    iex_thread.start()
+
+    fse_thread = threading.Thread(target=evaluate_fse_stocks)
+    fse_thread.start()
+
+    #sandp500_thread = threading.Thread(target=evaluate_sandp500_stocks)
+    #sandp500_thread.start()
+
+    iex_thread.join()
+    fse_thread.join()
+    #sandp500_thread.join()
+    if (not indicator_pool is None):
+        indicator_pool.close()
+
+    send_alarm(alarms)
+    report.write(config.run_report_file)
+    close_notifier()
+
+if __name__ == '__main__':
+    main()
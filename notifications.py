@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+
+from emailer import Emailer
+
+logger = logging.getLogger(__name__)
+
+class AlarmState:
+    """
+    Remembers per symbol in which direction it exceeds its thresholds and when it was last notified,
+    so only new crossings and, every reminder_days days, reminders are mailed.
+    Symbols are forgotten once an evaluation of their source finds them inside their thresholds again.
+    \n
+    Constructor Params:
+    - file_name     -- json file the state is kept in between runs
+    - reminder_days -- days after which a symbol still exceeding its thresholds is notified again, 0 never
+    """
+
+    def __init__(self, file_name, reminder_days):
+        self.file_name = file_name
+        self.reminder_days = reminder_days
+        self.lock = threading.Lock()
+        # symbol -> {'zone': -1 below / 1 above, 'source': remote source, 'notified': yyyy-mm-dd or None}
+        self.alarms = {}
+        if (os.path.exists(file_name)):
+            with open(file_name) as state_file:
+                self.alarms = json.load(state_file)
+
+    def is_due(self, symbol, zone):
+        """Returns True if an alarm of the symbol in the given zone should be notified today."""
+        with self.lock:
+            alarm = self.alarms.get(symbol)
+        if (alarm is None or alarm['zone'] != zone or alarm['notified'] is None):
+            return True
+        if (self.reminder_days <= 0):
+            return False
+        reminder_date = datetime.strptime(alarm['notified'], '%Y-%m-%d') + timedelta(self.reminder_days)
+        return reminder_date <= datetime.now()
+
+    def update(self, zones, sources):
+        """
+        Takes the result of an evaluation: zones is a dict of symbol to (zone, source) of all symbols
+        exceeding their thresholds, sources are the evaluated sources. Symbols of these sources
+        which are not in zones anymore are forgotten.
+        """
+        with self.lock:
+            for symbol, alarm in list(self.alarms.items()):
+                if (alarm['source'] in sources and symbol not in zones):
+                    del self.alarms[symbol]
+            for symbol, (zone, source) in zones.items():
+                alarm = self.alarms.get(symbol)
+                if (alarm is None or alarm['zone'] != zone):
+                    self.alarms[symbol] = {'zone': zone, 'source': source, 'notified': None}
+            self.save()
+
+    def mark_notified(self, symbols):
+        """Records that the alarms of the given symbols were delivered today."""
+        today = datetime.strftime(datetime.now(), '%Y-%m-%d')
+        with self.lock:
+            for symbol in symbols:
+                if (symbol in self.alarms):
+                    self.alarms[symbol]['notified'] = today
+            self.save()
+
+    def save(self):
+        # Replace the file at once, an interrupted write must not lose the state
+        temporary_file = self.file_name + '.tmp'
+        with open(temporary_file, 'w') as state_file:
+            json.dump(self.alarms, state_file)
+        os.replace(temporary_file, self.file_name)
+
+class Notifier:
+    """
+    Delivers mails to all configured recipients in a background thread, so a slow mail server
+    does not block the evaluation. A mail is rendered once when it is queued and sent to all
+    recipients over one SMTP session. Mails queued while a delivery runs are sent together
+    over the next session.
+    \n
+    Constructor Params:
+    - recipients -- list of mail addresses
+    - emailer    -- Emailer used to render and send, a default one if None
+    """
+
+    def __init__(self, recipients, emailer=None):
+        self.recipients = recipients
+        self.emailer = emailer or Emailer()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.deliver, name='Notifier', daemon=True)
+        self.thread.start()
+
+    def notify(self, subject, text, image=None, on_delivered=None):
+        """Queues a mail. on_delivered is called without arguments once it was sent to all recipients."""
+        if (len(self.recipients) == 0):
+            return
+        message = self.emailer.create_message(None, subject, text, image)
+        self.queue.put((message, on_delivered))
+
+    def deliver(self):
+        while (True):
+            pending = [self.queue.get()]
+            while (not self.queue.empty()):
+                pending.append(self.queue.get())
+            stop = None in pending
+            pending = [notification for notification in pending if not notification is None]
+            if (len(pending) > 0):
+                self.send(pending)
+            if (stop):
+                return
+
+    def send(self, pending):
+        try:
+            with self.emailer.connect() as server:
+                for message, on_delivered in pending:
+                    self.emailer.send_over(server, self.recipients, message)
+                    logger.info(f'Sent "{message["Subject"]}" to {len(self.recipients)} recipients')
+                    if (not on_delivered is None):
+                        on_delivered()
+        except Exception:
+            logger.exception(f'Could not deliver {len(pending)} mails')
+
+    def close(self):
+        """Waits until all queued mails are delivered and stops the background thread."""
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+class PriceCache:
+    """
+    Stores the closing prices of all symbols of one database as a single dates by symbols matrix,
+    so a whole universe loads with one read instead of one SQL query per symbol.
+    \n
+    Backends:
+    - npy     -- memory mapped NumPy file, loads without copying, no extra dependency
+    - parquet -- columnar Parquet file, requires pyarrow
+    - feather -- columnar Feather file, requires pyarrow
+    \n
+    Constructor Params:
+    - file_name -- file name without extension, the cache files are put into ./data
+    - backend   -- one of the backends above
+    """
+
+    backends = ['npy', 'parquet', 'feather']
+
+    def __init__(self, file_name, backend):
+        if (backend not in self.backends):
+            raise ValueError(f'Unknown cache format: {backend}')
+        self.backend = backend
+        self.path = f'./data/{file_name}.closings'
+        self.meta_file = f'{self.path}.json'
+
+    def load(self, fingerprint):
+        """Returns the cached pandas.DataFrame (ascending dates, one column per symbol)
+        or None if there is no cache or it was written for another fingerprint."""
+        try:
+            with open(self.meta_file) as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if (meta['fingerprint'] != fingerprint):
+            logger.info(f'Price cache {self.path} is outdated.')
+            return None
+        try:
+            if (self.backend == 'npy'):
+                values = np.load(f'{self.path}.npy', mmap_mode='r')
+                dates = pd.to_datetime(np.load(f'{self.path}.dates.npy'))
+                closings = pd.DataFrame(values, index=dates, columns=meta['symbols'], copy=False)
+            elif (self.backend == 'parquet'):
+                closings = pd.read_parquet(f'{self.path}.parquet')
+            else:
+                closings = pd.read_feather(f'{self.path}.feather').set_index('Date')
+        except (OSError, ValueError, ImportError) as e:
+            logger.warning(f'Could not read price cache {self.path}. Cause: {e}')
+            return None
+        logger.info(f'Loaded {closings.shape[1]} symbols from price cache {self.path}.')
+        return closings
+
+    def save(self, closings, fingerprint):
+        """Writes the closing prices. The fingerprint identifies the database state they were read from."""
+        closings.index.names = ['Date']
+        try:
+            # Without meta file the cache is invalid until it is completely written
+            if (os.path.exists(self.meta_file)):
+                os.remove(self.meta_file)
+            if (self.backend == 'npy'):
+                np.save(f'{self.path}.npy.tmp', closings.to_numpy(dtype=float), allow_pickle=False)
+                np.save(f'{self.path}.dates.npy.tmp', closings.index.values.astype('datetime64[ns]'), allow_pickle=False)
+                os.replace(f'{self.path}.npy.tmp.npy', f'{self.path}.npy')
+                os.replace(f'{self.path}.dates.npy.tmp.npy', f'{self.path}.dates.npy')
+            elif (self.backend == 'parquet'):
+                closings.to_parquet(f'{self.path}.parquet')
+            else:
+                closings.reset_index().to_feather(f'{self.path}.feather')
+        except (OSError, ValueError, ImportError) as e:
+            logger.warning(f'Could not write price cache {self.path}. Cause: {e}')
+            return
+        with open(self.meta_file, 'w') as meta_file:
+            json.dump({'fingerprint': fingerprint, 'symbols': [str(symbol) for symbol in closings.columns]}, meta_file)
+        logger.info(f'Wrote {closings.shape[1]} symbols to price cache {self.path}.')
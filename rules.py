@@ -0,0 +1,103 @@
+import numpy as np
+
+from technical_indicators import Indicators
+
+operators = ('<', '>', 'crosses above', 'crosses below')
+
+def get_run_starts(mask):
+    """
+    Run-length encoding of every column of a 2d boolean array (dates, symbols): returns the row at
+    which the run of True values containing each cell started, -1 where the cell is False.
+    """
+    rows = np.arange(mask.shape[0])[:, np.newaxis]
+    last_false = np.maximum.accumulate(np.where(mask, -1, rows), axis=0)
+    return np.where(mask, last_false + 1, -1)
+
+def get_streaks(mask, last_rows):
+    """
+    Returns (start rows, lengths) of the runs of True values ending at last_rows, one per column of
+    a 2d boolean array (dates, symbols). Start row -1 and length 0 where the cell of last_rows is False.
+    """
+    columns = np.arange(mask.shape[1])
+    starts = np.full(mask.shape[1], -1)
+    known = last_rows >= 0
+    starts[known] = get_run_starts(mask)[last_rows[known], columns[known]]
+    lengths = np.where(starts >= 0, last_rows - starts + 1, 0)
+    return starts, lengths
+
+class Rule:
+    """
+    An alarm condition evaluated on the indicators of all symbols at once, e.g. ('EMA10', 'crosses above', 'EMA100').
+    A symbol alarms if the condition holds on its latest date and has held for min_days to max_days trading days.
+    \n
+    Constructor Params:
+    - name      -- shown in the alarm mail
+    - condition -- (operand, operator, operand). Operands are names of technical_indicators.Indicators,
+                   'Close', 'min_rsi' and 'max_rsi' (the thresholds of the symbol) or numbers.
+                   Operators are '<', '>', 'crosses above' and 'crosses below'.
+    - min_days  -- trading days the condition has to hold at least
+    - max_days  -- trading days the condition may hold at most. Defaults to 1 for crossings, so
+                   they alarm on the day of the crossing only, and to no limit otherwise.
+    """
+
+    def __init__(self, name, condition, min_days=1, max_days=None):
+        self.name = name
+        self.left, self.operator, self.right = condition
+        if (self.operator not in operators):
+            raise ValueError(f'Rule {name}: Unknown operator {self.operator}, use one of {operators}')
+        for operand in (self.left, self.right):
+            if (isinstance(operand, str) and operand not in ('Close', 'min_rsi', 'max_rsi') and operand not in Indicators.__members__):
+                raise ValueError(f'Rule {name}: Unknown operand {operand}')
+        self.min_days = min_days
+        self.max_days = max_days
+        if (self.max_days is None and self.operator.startswith('crosses')):
+            self.max_days = 1
+
+    def get_masks(self, operands):
+        """Returns 2d boolean arrays (dates, symbols) of the days on which the condition holds
+        and of the days on which both operands are known."""
+        left = self.get_operand(self.left, operands)
+        right = self.get_operand(self.right, operands)
+        known = ~np.isnan(left) & ~np.isnan(right)
+        with np.errstate(invalid='ignore'):
+            if (self.operator in ('<', 'crosses below')):
+                return left < right, known
+            return left > right, known
+
+    def get_operand(self, operand, operands):
+        if (isinstance(operand, str)):
+            return operands[operand]
+        return float(operand)
+
+    def evaluate(self, operands, last_rows):
+        """Returns (alarming, start rows) per symbol, see get_streaks."""
+        mask, known = self.get_masks(operands)
+        starts, lengths = get_streaks(mask, last_rows)
+        alarming = lengths >= max(self.min_days, 1)
+        if (not self.max_days is None):
+            alarming &= lengths <= self.max_days
+        if (self.operator.startswith('crosses')):
+            # A run starting on the first day both operands are known, e.g. once an indicator has enough data, is no crossing
+            before = np.maximum(starts - 1, 0)
+            alarming &= (starts > 0) & np.broadcast_to(known, mask.shape)[before, np.arange(mask.shape[1])]
+        return alarming, starts
+
+def get_operands(indicators, closings, min_rsi, max_rsi):
+    """
+    Returns the operands of all rules as numpy arrays (dates, symbols) or (1, symbols) for the thresholds.
+    \n
+    Params:
+    - indicators -- wide result of technical_indicators.compute_indicators for closings
+    - closings   -- pandas.DataFrame of closing prices, ascending dates as index, one column per symbol
+    - min_rsi    -- numpy array of the min RSI of every symbol
+    - max_rsi    -- numpy array of the max RSI of every symbol
+    """
+    operands = {indicator.name: indicators[indicator.name][closings.columns].to_numpy() for indicator in Indicators}
+    operands['Close'] = closings.to_numpy(dtype=float)
+    operands['min_rsi'] = np.asarray(min_rsi, dtype=float)[np.newaxis, :]
+    operands['max_rsi'] = np.asarray(max_rsi, dtype=float)[np.newaxis, :]
+    return operands
+
+def get_rules(definitions):
+    """Returns the Rules of a dict of rule name to keyword arguments of Rule, as declared in config.ini."""
+    return [Rule(name, **definition) for name, definition in definitions.items()]
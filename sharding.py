@@ -0,0 +1,144 @@
+"""
+Sharded evaluation of large universes. The universe of every source is split into shards by a hash
+of the symbol, every shard is evaluated in a worker process against the shared DB (see [data] database
+in config.ini) and the alarms and counts of all shards are merged into one alarm mail and run report.
+
+Locally the shards run on a pool of worker processes:
+    python sharding.py --sources iex quandl --shards 8 --processes 4
+    python sharding.py --sources iex quandl --by source      (one shard per source)
+
+On several nodes every node evaluates its shards against its own data directory and writes their results,
+one node merges the result files copied to it and sends the mail:
+    python sharding.py --sources iex --shards 8 --shard 3 --output results/iex_3.pickle
+    python sharding.py --merge results/*.pickle
+The data directory must not be shared between nodes, e.g. on a network filesystem: the DB runs in
+SQLite's WAL mode, which requires all connections to be on the same host. Only the result files are exchanged.
+"""
+
+import argparse
+import copy
+import logging
+import multiprocessing
+import os
+import pickle
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import helpers
+import monitor
+from alarms import AlarmCollector
+from fetcher import FetchScheduler
+from instrumentation import report
+from stock import Stock
+
+logger = logging.getLogger(__name__)
+
+# Evaluation of one shard: the alarms, the number of evaluated stocks and the run report of its process
+ShardResult = namedtuple('ShardResult', ['source', 'shard', 'shard_count', 'stock_count', 'alarms', 'report'])
+
+def get_shard(symbol, shard_count):
+    """Returns the shard of a symbol. Stable across processes and nodes, unlike hash()."""
+    return zlib.crc32(symbol.encode('utf-8')) % shard_count
+
+def evaluate_shard(source, shard, shard_count, today):
+    """
+    Evaluates the symbols of the universe of source which fall into the given shard and returns a ShardResult.
+    Runs in a worker process: the alarm state is only read, the caller merges the results and sends the mail.
+    """
+    Stock.today = today
+    monitor.alarms = AlarmCollector(config.alarm_report_top, monitor.get_alarm_state().is_due)
+    report.reset()
+    csv_file = f'{monitor.universes[source]}.csv'
+    universe = (entry for entry in monitor.iter_universe(source, csv_file) if get_shard(entry[1], shard_count) == shard)
+    logger.info(f'{source}: Evaluating shard {shard + 1} of {shard_count}')
+    with report.timer('evaluation', source):
+        # The price cache file is shared by all shards, it is refreshed once after the merge
+        stock_count = monitor.evaluate_entries(source, monitor.resolve_thresholds(universe), monitor.get_store(source),
+            FetchScheduler(source), refresh_cache=False)
+    return ShardResult(source, shard, shard_count, stock_count, monitor.alarms, copy.deepcopy(report))
+
+def init_worker(log_level, rate_share):
+    """Sets up a worker process. rate_share processes request a source at the same time, they split its request rate."""
+    helpers.setup_logging(log_level, process_name=True)
+    config.fetch_requests_per_second_per_source = {source: rate / rate_share for source, rate in config.fetch_requests_per_second_per_source.items()}
+
+def get_tasks(sources, by, shard_count):
+    """Returns (source, shard, shard_count) of all shards."""
+    if (by == 'source'):
+        return [(source, 0, 1) for source in sources]
+    return [(source, shard, shard_count) for source in sources for shard in range(shard_count)]
+
+def evaluate_shards(tasks, processes):
+    """Evaluates the shards on a pool of worker processes. Returns their ShardResults in the order of tasks."""
+    # Every process opens its own DB connections and threads, none are inherited
+    context = multiprocessing.get_context('spawn')
+    rate_share = min(processes, max(shard_count for _, _, shard_count in tasks))
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_worker, initargs=(config.log_level, rate_share)) as executor:
+        futures = [executor.submit(evaluate_shard, source, shard, shard_count, Stock.today) for source, shard, shard_count in tasks]
+        return [future.result() for future in futures]
+
+def merge(results):
+    """Merges the alarms, counts and run reports of ShardResults into those of this process."""
+    monitor.alarms = AlarmCollector(config.alarm_report_top, monitor.get_alarm_state().is_due)
+    monitor.evaluated_stocks.clear()
+    for result in results:
+        monitor.alarms.merge(result.alarms)
+        monitor.evaluated_stocks[result.source] = monitor.evaluated_stocks.get(result.source, 0) + result.stock_count
+        report.merge(result.report)
+    logger.info(f'Merged {len(results)} shards: {sum(monitor.evaluated_stocks.values())} stocks, '
+        f'{monitor.alarms.below_count} below and {monitor.alarms.above_count} above thresholds')
+
+def send_report(results):
+    """Merges the ShardResults, refreshes the price caches and sends one alarm mail for all of them."""
+    merge(results)
+    for source in monitor.evaluated_stocks:
+        monitor.get_store(source).refresh_cache()
+    monitor.send_alarm(monitor.alarms)
+    report.write(config.run_report_file)
+    monitor.close_notifier()
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the universes in shards on several processes or nodes.')
+    parser.add_argument('--sources', nargs='+', default=['iex', 'quandl'], choices=monitor.universes.keys(), help='universes to evaluate')
+    parser.add_argument('--by', default='hash', choices=['hash', 'source'], help='split every universe into --shards shards by symbol hash, or one shard per source')
+    parser.add_argument('--shards', type=int, default=os.cpu_count(), help='shards per universe')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--shard', type=int, help='only evaluate this shard (0 based) of every source and write its results to --output')
+    parser.add_argument('--output', help='file the results of --shard are written to')
+    parser.add_argument('--merge', nargs='+', metavar='RESULT', help='merge result files of --shard and send the alarm mail')
+    args = parser.parse_args()
+    # Up to --shards nodes request a source at the same time
+    init_worker(config.log_level, args.shards if not args.shard is None and args.by == 'hash' else 1)
+    os.environ["IEX_API_KEY"] = config.data_iex_api_key
+
+    if (args.merge):
+        results = []
+        for file_name in args.merge:
+            with open(file_name, 'rb') as result_file:
+                results.extend(pickle.load(result_file))
+        send_report(results)
+        return
+
+    # Import former per universe DB files once, before the workers open the shared DB
+    for source in args.sources:
+        monitor.get_store(source)
+    tasks = get_tasks(args.sources, args.by, args.shards)
+    if (not args.shard is None):
+        if (args.output is None):
+            parser.error('--shard requires --output')
+        results = [evaluate_shard(source, shard, shard_count, Stock.today)
+            for source, shard, shard_count in tasks if shard == args.shard]
+        with open(args.output, 'wb') as result_file:
+            pickle.dump(results, result_file)
+        logger.info(f'Wrote the results of {len(results)} shards to {args.output}')
+        monitor.close_notifier()
+        return
+
+    with report.timer('sharded_evaluation'):
+        results = evaluate_shards(tasks, args.processes)
+    send_report(results)
+
+if __name__ == '__main__':
+    main()
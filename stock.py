@@ -1,18 +1,21 @@
-from matplotlib import pyplot as plot
+import logging
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from pandas.plotting import register_matplotlib_converters
-register_matplotlib_converters()
-from enum import Enum
+from datetime import datetime
 
 import config
 import helpers
+import rules
 import technical_indicators as technical_indicators
+import trading_calendar
+
+logger = logging.getLogger(__name__)
 
 class Stock:
     """
-    This class represents a stock with access to its prices and derived indicators
+    This class represents a stock with access to its prices and derived indicators.
+    Prices are loaded on first use. For large universes call load_closing_prices() and,
+    once the RSI is evaluated, release(): only the summary fields for the alarm report stay.
     \n
     Constructor Params:
     - days          -- timeframe, looking backwards from today
@@ -25,6 +28,9 @@ class Stock:
     - max_rsi       -- send alarm for this stock if above this value
     """
 
+    __slots__ = ['days', 'name', 'symbol', 'data_access', 'source', 'min_rsi', 'max_rsi',
+        'last_rsi', 'last_date', 'exceeded_since', 'has_enough_data', 'df', 'closings', 'released']
+
     today = datetime.strftime(datetime.now(), '%Y-%m-%d')
 
     def __init__(self, days, name, symbol, data_access, source, min_rsi=config.default_min_rsi, max_rsi=config.default_max_rsi):
@@ -33,21 +39,60 @@ class Stock:
         self.symbol = symbol
         self.data_access = data_access
         self.source = source
-        self.df = self.get_stock_data(source)
         self.min_rsi = min_rsi
         self.max_rsi = max_rsi
         self.last_rsi = -1
-        if (self.df.size > 0):
-            self.has_enough_data = True
-        else:
-            self.has_enough_data = False
+        self.last_date = None
+        self.exceeded_since = None
+        self.has_enough_data = None
+        self.df = None
+        self.closings = None
+        self.released = False
+
+    def load(self):
+        """Fetches the prices of this stock unless they are loaded already."""
+        if (self.df is None):
+            self.df = self.get_stock_data(self.source)
+            self.has_enough_data = self.df.size > 0
+
+    def load_closing_prices(self):
+        """
+        Keeps only the business day closing prices and the date of the most recent price and drops
+        the price frame. Returns the closing prices or None if there are not enough data.
+        """
+        self.load()
+        if (self.has_enough_data):
+            try:
+                self.closings = self.get_closing_prices()
+                self.last_date = self.get_last_date()
+            except KeyError as e:
+                logger.warning(f'{self.symbol}: Could not determine RSI. Cause: {e}')
+                self.has_enough_data = False
+        self.df = None
+        return self.closings
+
+    def release(self):
+        """Drops all prices for good. last_rsi and the exceeded since date stay available for the alarm report."""
+        self.df = None
+        self.closings = None
+        self.released = True
+
+    def __getstate__(self):
+        # Sent to other processes with the summary fields only, see release
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state.update(data_access=None, df=None, closings=None, released=True)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def get_stock_data(self, source):
         """
         Fetches this stock as pandas.DataFrame\n
         """
-        # QUANDL FSE Data is updated 6:30 pm ET == 00:30 am Berlin
-        print(f'{self.symbol}: Getting data from source: [{source}]')
+        # QUANDL FSE Data is updated 6:30 pm ET == 00:30 am Berlin, see [daemon] schedule in config.ini
+        logger.debug(f'{self.symbol}: Getting data from source: [{source}]')
         past_date = helpers.get_date_in_the_past(self.days)
         if (config.use_database):
             df = self.data_access.get_df(self.symbol, past_date, self.today, source)
@@ -60,27 +105,25 @@ class Stock:
 
     def get_closing_prices(self):
         """
-        Get panda time series of closing prices for this stock. Only consider business days.
+        Get panda time series of closing prices for this stock on the trading days of its exchange.
         """
+        self.load()
         if (self.source == 'iex'):
             self.df = self.df.rename(columns={"close": "Close"})
             self.df.index = pd.to_datetime(self.df.index)
             #self.df = self.df.iloc[::-1]
-        close = self.df['Close']
         past_date = helpers.get_date_in_the_past(self.days)
-        all_weekdays = pd.date_range(start=past_date, end=self.today, freq='B')
-        close = close.reindex(all_weekdays)
-        # Fills N/A with last known value
-        close = close.fillna(method='ffill')
-        return close
+        # Days without a price carry the last known value
+        return trading_calendar.get_calendar(self.source, past_date, self.today).align(self.df['Close'])
 
     def get_latest_rsi(self):
         """
         Returns latest RSI value, calculates RSI history first if necessary. 
         Returns -1 in case calculation is impossible.
         """
+        self.load()
         if (not self.has_enough_data):
-            print(f'{self.symbol}: Not enough data to calculate RSI', flush=True)
+            logger.debug(f'{self.symbol}: Not enough data to calculate RSI')
             return -1
         try:
             if ('RSI14' not in self.df.columns):
@@ -90,23 +133,33 @@ class Stock:
             self.last_rsi = last_rsi
             return last_rsi
         except (KeyError, ValueError) as e:
-            print(f'{self.symbol}: Could not determine RSI. Cause: {e}', flush=True)
+            logger.warning(f'{self.symbol}: Could not determine RSI. Cause: {e}')
             return -1
 
-    # This approach breaks when RSI oscilates between the 2 thresholds in 2 consecutive intervals.
-    # For the sake of simplicity, we don't handle that case here.
+    def get_last_date(self):
+        """Returns the date of the most recent price of this stock."""
+        if (self.last_date is None):
+            self.load()
+            return self.df.index.max()
+        return self.last_date
+
     def get_rsi_exceeded_since_date(self):
-        '''Gets the date since when RSI thresholds are exceeded'''
-        # Create boolean mask of exceed yes/no and filter df with it
-        above = self.df['RSI14'] >= self.max_rsi
-        below = self.df['RSI14'] <= self.min_rsi
-        exceed_mask = above | below
-        # Get date of the first index where the threshold is not exceeded
-        # And add 1 day. This way we can be sure we are actually looking
-        # at the most recent exceeding interval.
-        first_date_not_exceeded = self.df[exceed_mask.eq(0)].index[0]
-        first_date_exceeded = first_date_not_exceeded + timedelta(days=1)
-        return datetime.strftime(first_date_exceeded, '%Y-%m-%d')
+        '''Gets the date since when RSI thresholds are exceeded. None if it is not known and the prices were released.'''
+        if (self.exceeded_since is None and not self.released):
+            self.get_latest_rsi()
+            self.exceeded_since = self.find_exceeded_since_date(self.df['RSI14'])
+        return self.exceeded_since
+
+    def find_exceeded_since_date(self, rsi):
+        '''Gets the date since when the RSI is on the side of the thresholds it is on at the latest date, from a RSI series, latest date first'''
+        rsi = rsi.iloc[::-1]
+        values = rsi.to_numpy()
+        with np.errstate(invalid='ignore'):
+            exceeded = values < self.min_rsi if values[-1] < self.min_rsi else values > self.max_rsi
+        starts, _ = rules.get_streaks(exceeded[:, np.newaxis], np.array([len(values) - 1]))
+        if (starts[0] < 0):
+            return None
+        return datetime.strftime(rsi.index[starts[0]], '%Y-%m-%d')
 
     def draw_plot(self, indicators):
         """
@@ -115,12 +168,16 @@ class Stock:
         params:
         indicators -- list of technical_indicators.Indicators to draw addionally
         """
+        plot = helpers.get_pyplot(headless=False)
+        self.get_latest_rsi()
         prices = self.get_closing_prices()
         fig, ax = plot.subplots(2, 1, constrained_layout=True, figsize=(16,9))
         ax[0].plot(prices.index, prices, label=self.symbol)
 
-        self.df = technical_indicators.get_sma(self.df, prices, 10)
-        self.df = technical_indicators.get_ema(self.df, prices, 10)
+        if ('SMA10' not in self.df.columns):
+            self.df = technical_indicators.get_sma(self.df, prices, 10)
+        if ('EMA10' not in self.df.columns):
+            self.df = technical_indicators.get_ema(self.df, prices, 10)
         # TODO: Extend here for more indicators to plot
 
         # Price and general Indicators
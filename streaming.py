@@ -0,0 +1,243 @@
+"""
+Intraday monitoring. Prices of the monitored symbols arrive as ticks from a PriceFeed and every tick
+updates the RSI of its symbol in O(1): the RSI of the completed days with the tick price as close of
+the current day. Crossing a threshold raises an alarm right away.
+
+Usage:
+    python streaming.py --source iex --replay 2019-06-01 2019-06-30 --steps 10
+    some_price_source | python streaming.py --source iex    (lines of time,symbol,price on stdin)
+"""
+
+import argparse
+import logging
+import queue
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import config
+import helpers
+import monitor
+from technical_indicators import Indicators
+
+logger = logging.getLogger(__name__)
+
+Tick = namedtuple('Tick', ['time', 'symbol', 'price'])
+
+# Period of the monitored RSI
+rsi_period = 14
+
+class PriceFeed:
+    """Source of the ticks of a StreamMonitor. Iterating yields Ticks in time order until the feed ends or is closed."""
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class ReplayFeed(PriceFeed):
+    """
+    Replays stored closing prices as ticks, day by day, for testing without a live source.
+    Every close is reached in steps ticks, moving in a straight line from the close of the day before.
+    \n
+    Constructor Params:
+    - closings -- pandas.DataFrame with ascending dates as index and one column per symbol, e.g. DataAccess.get_close_matrix()
+    - steps    -- ticks per symbol and day
+    - interval -- seconds to wait between two days, 0 replays as fast as possible
+    """
+
+    def __init__(self, closings, steps=1, interval=0):
+        self.closings = closings
+        self.steps = steps
+        self.interval = interval
+        self.closed = False
+
+    def __iter__(self):
+        symbols = list(self.closings.columns)
+        prices = self.closings.to_numpy(dtype=float)
+        previous = np.full(len(symbols), np.nan)
+        for row, date in enumerate(self.closings.index):
+            close = prices[row]
+            # The first day and days after a gap start at their close
+            start = np.where(np.isnan(previous), close, previous)
+            for step in range(1, self.steps + 1):
+                tick_time = date + timedelta(minutes=step)
+                step_prices = start + (close - start) * step / self.steps
+                for index, symbol in enumerate(symbols):
+                    if (self.closed):
+                        return
+                    if (not np.isnan(step_prices[index])):
+                        yield Tick(tick_time, symbol, step_prices[index])
+            previous = np.where(np.isnan(close), previous, close)
+            if (self.interval > 0):
+                time.sleep(self.interval)
+
+    def close(self):
+        self.closed = True
+
+class QueueFeed(PriceFeed):
+    """Ticks pushed by other threads with put(), e.g. by the client of a streaming API. Iteration ends after close()."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def put(self, symbol, price, tick_time=None):
+        self.queue.put(Tick(tick_time or datetime.now(), symbol, price))
+
+    def __iter__(self):
+        while (True):
+            tick = self.queue.get()
+            if (tick is None):
+                return
+            yield tick
+
+    def close(self):
+        self.queue.put(None)
+
+class LineFeed(PriceFeed):
+    """
+    Ticks read as lines of time,symbol,price (time as yyyy-mm-dd HH:MM:SS) from a text stream, e.g. stdin.
+    \n
+    Constructor Params:
+    - stream -- file object to read from
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        for line in self.stream:
+            try:
+                tick_time, symbol, price = line.strip().split(',')
+                yield Tick(datetime.strptime(tick_time, '%Y-%m-%d %H:%M:%S'), symbol, float(price))
+            except ValueError:
+                logger.warning(f'Skipping malformed tick: {line.strip()}')
+
+class SymbolStream:
+    """Intraday state of one symbol in a StreamMonitor."""
+
+    __slots__ = ['index', 'min_rsi', 'max_rsi', 'session', 'price', 'rsi', 'zone']
+
+    def __init__(self, index, rsi, min_rsi, max_rsi):
+        # Position of the symbol in the IndicatorStates of the StreamMonitor
+        self.index = index
+        self.min_rsi = min_rsi
+        self.max_rsi = max_rsi
+        # Date of the current day as yyyy-mm-dd and its latest price
+        self.session = None
+        self.price = None
+        self.rsi = rsi
+        self.zone = self.get_zone(self.rsi)
+
+    def get_zone(self, rsi):
+        """Returns -1 below min RSI, 1 above max RSI, 0 otherwise."""
+        if (rsi < self.min_rsi):
+            return -1
+        if (rsi > self.max_rsi):
+            return 1
+        return 0
+
+class StreamMonitor:
+    """
+    Keeps the RSI of every monitored symbol current while ticks arrive. A tick of a new day first
+    closes the day before with its last price. Calls on_alarm(symbol, rsi, zone, tick) once when
+    a symbol crosses below its min RSI (zone -1) or above its max RSI (zone 1).
+    \n
+    Constructor Params:
+    - thresholds -- dict of symbol to (min_rsi, max_rsi), only these symbols are monitored
+    - states     -- technical_indicators.IndicatorStates of the days before the stream, holding all monitored symbols
+    - on_alarm   -- callable, called in the thread processing the ticks
+    """
+
+    def __init__(self, thresholds, states, on_alarm):
+        self.on_alarm = on_alarm
+        self.states = states
+        rsi = states.get_values(Indicators[f'RSI{rsi_period}'])
+        self.streams = {}
+        for symbol, (min_rsi, max_rsi) in thresholds.items():
+            index = states.positions[symbol]
+            self.streams[symbol] = SymbolStream(index, rsi[index], min_rsi, max_rsi)
+        self.ticks = 0
+        self.alarms = 0
+
+    def process(self, tick):
+        stream = self.streams.get(tick.symbol)
+        if (stream is None):
+            return
+        self.ticks += 1
+        session = tick.time.strftime('%Y-%m-%d')
+        if (session != stream.session):
+            last_date = self.states.get_last_date(stream.index)
+            if (not last_date is None and session <= last_date):
+                # The day is already part of the indicator state
+                return
+            if (not stream.session is None):
+                self.states.update([stream.index], np.datetime64(stream.session, 'D').astype(float), [stream.price])
+            stream.session = session
+        stream.price = tick.price
+        stream.rsi = self.states.preview_rsi(rsi_period, [stream.index], [tick.price])[0]
+        zone = stream.get_zone(stream.rsi)
+        if (zone != stream.zone):
+            stream.zone = zone
+            if (zone != 0):
+                self.alarms += 1
+                self.on_alarm(tick.symbol, stream.rsi, zone, tick)
+
+    def run(self, feed):
+        """Processes all ticks of the feed. Returns the number of processed ticks."""
+        start = time.perf_counter()
+        for tick in feed:
+            self.process(tick)
+        seconds = time.perf_counter() - start
+        logger.info(f'Processed {self.ticks} ticks in {seconds:.1f} s, {self.alarms} alarms')
+        return self.ticks
+
+def load_states(data_access, symbols, before_date, closings):
+    """Returns the technical_indicators.IndicatorStates of the symbols with all stored closing prices before
+    before_date (yyyy-mm-dd). Stored states are advanced by the missing days, states reaching into before_date are rebuilt."""
+    states = data_access.get_indicator_states(symbols)
+    states.reset(np.flatnonzero(states.last_date >= np.datetime64(before_date, 'D').astype(float)))
+    closings = closings[closings.index < before_date].reindex(columns=symbols)
+    states.advance(closings.to_numpy(dtype=float), closings.index, np.full(len(symbols), len(closings) - 1))
+    return states
+
+def send_alarm(notifier, symbol, rsi, zone, tick):
+    direction = 'below min' if zone < 0 else 'above max'
+    message = f'{tick.time:%Y-%m-%d %H:%M:%S} {symbol}: RSI {rsi:2.2f} crossed {direction} threshold at price {tick.price:.2f}'
+    logger.warning(message)
+    if (config.email_smtp_server == ''):
+        return
+    # Mails are delivered in the background, the ticks of all other symbols must not wait for them
+    notifier.notify(f'Stock Monitor: {symbol} RSI {rsi:2.2f}', message)
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor the RSI of a universe on intraday prices.')
+    parser.add_argument('--source', default='iex', choices=monitor.universes.keys(), help='universe to monitor')
+    parser.add_argument('--replay', nargs=2, metavar=('START', 'END'), help='replay the stored prices between these dates instead of reading ticks from stdin')
+    parser.add_argument('--steps', type=int, default=1, help='ticks per symbol and day of the replay')
+    parser.add_argument('--interval', type=float, default=0, help='seconds between two days of the replay')
+    args = parser.parse_args()
+    helpers.setup_logging()
+
+    entries = monitor.read_universe(args.source, f'{monitor.universes[args.source]}.csv')
+    thresholds = {symbol: (min_rsi, max_rsi) for _, symbol, min_rsi, max_rsi in entries}
+    data_access = monitor.get_store(args.source)
+    closings = data_access.get_close_matrix(list(thresholds))
+    if (args.replay):
+        start_date, end_date = args.replay
+        feed = ReplayFeed(closings[start_date:end_date], args.steps, args.interval)
+    else:
+        start_date = datetime.strftime(datetime.now(), '%Y-%m-%d')
+        feed = LineFeed(sys.stdin)
+    states = load_states(data_access, list(thresholds), start_date, closings)
+
+    stream_monitor = StreamMonitor(thresholds, states, lambda *alarm: send_alarm(monitor.get_notifier(), *alarm))
+    stream_monitor.run(feed)
+    monitor.close_notifier()
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,13 @@
 # More indicators: https://github.com/Crypto-toolbox/pandas-technical-indicators/blob/master/technical_indicators.py
 
+import logging
 import pandas as pd
 import numpy as np
 from enum import Enum
 import traceback
 
+logger = logging.getLogger(__name__)
+
 class Indicators(Enum):
     RSI14 = 1
     EMA10 = 2
@@ -49,7 +52,7 @@ def get_rsi(symbol, df, series, period=14):
         #print(df)
         return df
     except (IndexError, ValueError) as e:
-        print(f'Error processing {symbol}. Cause: {e}')
+        logger.warning(f'Error processing {symbol}. Cause: {e}')
         return df
 
 def rsi(symbol, df, series, period=14):
@@ -97,4 +100,287 @@ def get_ema(df, prices, period):
         raise ValueError('Series too short for intended rolling avg')
     ema = pd.Series(prices.ewm(span=period, min_periods=period).mean(), name='EMA' + str(period))
     df = df.join(ema)
-    return df
\ No newline at end of file
+    return df
+
+def ewm_matrix(values, alpha, min_periods, ignore_na=False):
+    """
+    Exponentially weighted mean of every column of a 2d numpy array in one pass over the rows.
+    Matches pandas ewm(alpha=alpha, min_periods=min_periods, ignore_na=ignore_na) (adjust=True).
+    \n
+    Params:
+    - values      -- numpy array of shape (dates, symbols), NaN where no value is present
+    - alpha       -- smoothing factor
+    - min_periods -- minimum number of observations before a value is emitted
+    - ignore_na   -- True weights the values by their position among the values present, as if the NaN rows were dropped
+    """
+    decay = 1.0 - alpha
+    result = np.full(values.shape, np.nan)
+    numerator = np.zeros(values.shape[1])
+    denominator = np.zeros(values.shape[1])
+    observations = np.zeros(values.shape[1])
+    for row in range(values.shape[0]):
+        current = values[row]
+        observed = ~np.isnan(current)
+        row_decay = np.where(observed, decay, 1.0) if ignore_na else decay
+        numerator *= row_decay
+        denominator *= row_decay
+        numerator[observed] += current[observed]
+        denominator[observed] += 1.0
+        observations += observed
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[row] = np.where(observations >= min_periods, numerator / denominator, np.nan)
+    return result
+
+def rsi_matrix(prices, period=14):
+    """
+    Gets the rsi for every column of a 2d numpy price array (dates, symbols).
+    Same result as rsi() applied to every column on its own: the price changes into and out of
+    a missing price are dropped and the RSI at them is NaN.
+    """
+    delta = np.full(prices.shape, np.nan)
+    delta[1:] = prices[1:] - prices[:-1]
+    up = np.where(delta > 0, delta, 0.0)
+    down = np.where(delta < 0, -delta, 0.0)
+    up[np.isnan(delta)] = np.nan
+    down[np.isnan(delta)] = np.nan
+    alpha = 1.0 / period
+    rolling_up = ewm_matrix(up, alpha, period, ignore_na=True)
+    rolling_down = ewm_matrix(down, alpha, period, ignore_na=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rs = rolling_up / rolling_down
+        result = 100.0 - (100.0 / (1.0 + rs))
+    result[np.isnan(delta)] = np.nan
+    return result
+
+def sma_matrix(prices, period):
+    """Gets the simple moving average for every column of a 2d numpy price array (dates, symbols)."""
+    result = np.full(prices.shape, np.nan)
+    if (prices.shape[0] < period):
+        return result
+    missing = np.isnan(prices)
+    sums = np.cumsum(np.where(missing, 0.0, prices), axis=0)
+    missing_counts = np.cumsum(missing, axis=0)
+    window_sums = sums[period - 1:].copy()
+    window_sums[1:] -= sums[:-period]
+    window_missing = missing_counts[period - 1:].copy()
+    window_missing[1:] -= missing_counts[:-period]
+    result[period - 1:] = np.where(window_missing == 0, window_sums / period, np.nan)
+    return result
+
+def ema_matrix(prices, period):
+    """Gets the exponential moving average for every column of a 2d numpy price array (dates, symbols)."""
+    return ewm_matrix(prices, 2.0 / (period + 1.0), period)
+
+def compute_indicators(closings, indicators=Indicators):
+    """
+    Computes all given indicators for every symbol of a wide price frame at once.
+    \n
+    Params:
+    - closings   -- pandas.DataFrame of closing prices, ascending dates as index, one column per symbol
+    - indicators -- iterable of Indicators to compute, defaults to all
+    \n
+    Returns a pandas.DataFrame with (indicator name, symbol) columns, so result['RSI14'] is
+    a dates by symbols frame of RSI values.
+    """
+    prices = closings.to_numpy(dtype=float)
+    results = {}
+    for indicator in indicators:
+        results[indicator.name] = pd.DataFrame(get_indicator_matrix(indicator.name, prices), index=closings.index, columns=closings.columns)
+    return pd.concat(results, axis=1)
+
+def get_indicator_matrix(name, prices):
+    """Computes the indicator with the given Indicators name (e.g. 'RSI14') for a 2d numpy price array (dates, symbols)."""
+    functions = {'RSI': rsi_matrix, 'SMA': sma_matrix, 'EMA': ema_matrix}
+    return functions[name[:3]](prices, int(name[3:]))
+
+def get_days(dates):
+    """Returns a pandas.DatetimeIndex as float array of days since 1970-01-01, the dates of IndicatorStates."""
+    return dates.values.astype('datetime64[D]').astype(float)
+
+class IndicatorStates:
+    """
+    Running state of the Indicators of many symbols, advanced bar by bar for all symbols at once.
+    Gives the same values as rsi(), get_sma() and get_ema() over the complete series fed so far,
+    so a daily run only needs to feed the bars that arrived since the last run. The state of a
+    symbol is one row of floats, see get_rows.
+    \n
+    Constructor Params:
+    - symbols -- list of symbols, all states start empty
+    """
+
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.positions = {symbol: index for index, symbol in enumerate(self.symbols)}
+        count = len(self.symbols)
+        # Date of the last bar (see get_days) and its close, NaN before the first bar
+        self.last_date = np.full(count, np.nan)
+        self.last_close = np.full(count, np.nan)
+        self.bars = np.zeros(count)
+        # period -> rolling up and down numerators, shape (symbols, 2)
+        self.rsi = {}
+        # period -> last closing prices, shape (symbols, period)
+        self.sma = {}
+        # period -> numerator
+        self.ema = {}
+        for indicator in Indicators:
+            kind, period = indicator.name[:3], int(indicator.name[3:])
+            if (kind == 'RSI'):
+                self.rsi[period] = np.zeros((count, 2))
+            elif (kind == 'SMA'):
+                self.sma[period] = np.full((count, period), np.nan)
+            elif (kind == 'EMA'):
+                self.ema[period] = np.zeros(count)
+        self.width = sum(field.shape[1] for field in self.get_fields())
+
+    def get_fields(self):
+        """Returns the arrays of the states in the order of the columns of a row, all of shape (symbols, columns)."""
+        fields = [self.last_date[:, np.newaxis], self.last_close[:, np.newaxis], self.bars[:, np.newaxis]]
+        fields += list(self.rsi.values()) + list(self.sma.values())
+        return fields + [values[:, np.newaxis] for values in self.ema.values()]
+
+    def get_rows(self, indices):
+        """Returns the states of the symbols at indices as 2d float array (symbols, width)."""
+        return np.hstack([field[indices] for field in self.get_fields()])
+
+    def set_rows(self, indices, rows):
+        """Sets the states of the symbols at indices from rows as returned by get_rows."""
+        column = 0
+        for field in self.get_fields():
+            field[indices] = rows[:, column:column + field.shape[1]]
+            column += field.shape[1]
+
+    def reset(self, indices):
+        """Empties the states of the symbols at indices."""
+        self.last_date[indices] = np.nan
+        self.last_close[indices] = np.nan
+        self.bars[indices] = 0
+        for values in self.rsi.values():
+            values[indices] = 0.0
+        for values in self.sma.values():
+            values[indices] = np.nan
+        for values in self.ema.values():
+            values[indices] = 0.0
+
+    def get_last_date(self, index):
+        """Returns the date of the last bar of a symbol as yyyy-mm-dd, None before the first bar."""
+        if (np.isnan(self.last_date[index])):
+            return None
+        return str(np.datetime64(int(self.last_date[index]), 'D'))
+
+    def update(self, indices, days, closes):
+        """Advances the states of the symbols at indices by one bar each. days are the dates of the bars, see get_days."""
+        closes = np.asarray(closes, dtype=float)
+        observed = ~np.isnan(closes)
+        indices = np.asarray(indices)[observed]
+        days = np.broadcast_to(days, observed.shape)[observed]
+        closes = closes[observed]
+        # NaN for the first bar, which has no change
+        delta = closes - self.last_close[indices]
+        changes = np.column_stack([np.fmax(delta, 0.0), np.fmax(-delta, 0.0)])
+        for period, values in self.rsi.items():
+            values[indices] = values[indices] * (1.0 - 1.0 / period) + changes
+        for period, values in self.sma.items():
+            values[indices] = np.column_stack([values[indices, 1:], closes])
+        for period, values in self.ema.items():
+            values[indices] = values[indices] * get_ema_decay(period) + closes
+        self.bars[indices] += 1
+        self.last_date[indices] = days
+        self.last_close[indices] = closes
+
+    def advance(self, prices, dates, last_rows):
+        """
+        Feeds all prices of a 2d price array (dates, symbols in the order of the states) which are newer than
+        the states, up to and including the row last_rows of every symbol, -1 feeds nothing. A state the prices
+        do not reach back to starts over from the first price. Returns a boolean array of the changed states.
+        \n
+        Params:
+        - prices    -- numpy array (dates, symbols), NaN where no price is present
+        - dates     -- pandas.DatetimeIndex of the rows, ascending
+        - last_rows -- numpy int array, row of the most recent price of every symbol
+        """
+        days = get_days(dates)
+        known = ~np.isnan(prices)
+        first_rows = np.argmax(known, axis=0)
+        self.reset(np.flatnonzero(known.any(axis=0) & (days[first_rows] > self.last_date)))
+        changed = np.zeros(len(self.symbols), dtype=bool)
+        columns = np.arange(len(self.symbols))
+        for row in range(len(days)):
+            fed = known[row] & (row <= last_rows) & ~(self.last_date >= days[row])
+            if (fed.any()):
+                self.update(columns[fed], days[row], prices[row, fed])
+                changed |= fed
+        return changed
+
+    def get_values(self, indicator):
+        """Returns the current value of the given Indicators member of every symbol, NaN if there are not enough bars."""
+        kind, period = indicator.name[:3], int(indicator.name[3:])
+        if (kind == 'RSI'):
+            up, down = self.rsi[period].T
+            return self.get_rsi(up, down, self.bars - 1, period)
+        if (kind == 'SMA'):
+            return np.where(self.bars >= period, self.sma[period].mean(axis=1), np.nan)
+        return self.get_ema(self.ema[period], self.bars, period)
+
+    def get_history(self, prices, last_rows):
+        """
+        Returns a dict of Indicators name to a 2d array (dates, symbols) of its values at every row of the
+        price array the states were advanced by, up to last_rows. These are the values of the states, which
+        saw all prices before the array as well: the bars are taken out of the states again row by row,
+        back to the first price of every symbol in the array.
+        """
+        history = {indicator.name: np.full(prices.shape, np.nan) for indicator in Indicators}
+        bars = self.bars.copy()
+        rsi = {period: values.copy() for period, values in self.rsi.items()}
+        ema = {period: values.copy() for period, values in self.ema.items()}
+        # Price before every row, NaN before the first price of the array
+        previous = pd.DataFrame(prices).ffill().shift(1).to_numpy()
+        active = bars > 0
+        for row in range(prices.shape[0] - 1, -1, -1):
+            current = active & (row <= last_rows)
+            for period, values in rsi.items():
+                history[f'RSI{period}'][row, current] = self.get_rsi(values[current, 0], values[current, 1], bars[current] - 1, period)
+            for period, values in ema.items():
+                history[f'EMA{period}'][row, current] = self.get_ema(values[current], bars[current], period)
+            fed = current & ~np.isnan(prices[row])
+            # Without the price before, the states before this row are unknown
+            active &= ~(fed & np.isnan(previous[row]))
+            taken = fed & active
+            delta = prices[row, taken] - previous[row, taken]
+            changes = np.column_stack([np.fmax(delta, 0.0), np.fmax(-delta, 0.0)])
+            for period, values in rsi.items():
+                values[taken] = (values[taken] - changes) / (1.0 - 1.0 / period)
+            for period, values in ema.items():
+                values[taken] = (values[taken] - prices[row, taken]) / get_ema_decay(period)
+            bars[taken] -= 1
+        after_last_rows = np.arange(prices.shape[0])[:, np.newaxis] > last_rows
+        for period in self.sma:
+            # The closes of the window are all in the array
+            history[f'SMA{period}'] = np.where(after_last_rows, np.nan, sma_matrix(prices, period))
+        return history
+
+    def preview_rsi(self, period, indices, closes):
+        """Returns the RSI of the given period of the symbols at indices after one more bar with the given closes.
+        The states are not changed, so a price of a day which is still trading can be evaluated on every tick."""
+        up, down = self.rsi[period][indices].T
+        delta = np.asarray(closes, dtype=float) - self.last_close[indices]
+        fed = ~np.isnan(delta)
+        decay = 1.0 - 1.0 / period
+        up = np.where(fed, up * decay + np.fmax(delta, 0.0), up)
+        down = np.where(fed, down * decay + np.fmax(-delta, 0.0), down)
+        return self.get_rsi(up, down, self.bars[indices] - 1 + fed, period)
+
+    @staticmethod
+    def get_rsi(up, down, observations, period):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rsi = np.where(down == 0, 100.0, 100.0 - (100.0 / (1.0 + up / down)))
+        return np.where((observations < period) | ((up == 0) & (down == 0)), np.nan, rsi)
+
+    @staticmethod
+    def get_ema(numerator, bars, period):
+        # Sum of the weights of all bars, as pandas ewm(adjust=True)
+        weights = (1.0 - get_ema_decay(period) ** bars) / (1.0 - get_ema_decay(period))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(bars >= period, numerator / weights, np.nan)
+
+def get_ema_decay(period):
+    return 1.0 - 2.0 / (period + 1.0)
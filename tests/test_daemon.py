@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+import daemon
+import monitor
+from daemon import SourceService
+
+@pytest.fixture
+def quandl(monkeypatch):
+    monkeypatch.setattr(monitor, 'get_store', lambda source: None)
+    return SourceService('quandl', 'Europe/Berlin', '01:00', 1)
+
+def berlin(time):
+    return pd.Timestamp(time).tz_localize('Europe/Berlin').tz_convert('UTC')
+
+def test_session_is_evaluated_the_night_after(quandl):
+    # Friday 2026-10-16 after the close
+    session, run_at = quandl.get_next_run(berlin('2026-10-16 20:00'))
+    assert session == pd.Timestamp('2026-10-16')
+    assert run_at == pd.Timestamp('2026-10-17 01:00').tz_localize('Europe/Berlin')
+
+def test_session_is_pending_until_published(quandl):
+    session, run_at = quandl.get_next_run(berlin('2026-10-17 00:45'))
+    assert session == pd.Timestamp('2026-10-16')
+    session, run_at = quandl.get_next_run(berlin('2026-10-17 01:30'))
+    assert session == pd.Timestamp('2026-10-19')
+    assert run_at == pd.Timestamp('2026-10-20 01:00').tz_localize('Europe/Berlin')
+
+def test_last_session_is_the_last_published_one(quandl):
+    assert quandl.get_last_session(berlin('2026-10-17 00:45')) == pd.Timestamp('2026-10-15')
+    assert quandl.get_last_session(berlin('2026-10-17 01:00')) == pd.Timestamp('2026-10-16')
+    assert quandl.get_last_session(berlin('2026-10-18 12:00')) == pd.Timestamp('2026-10-16')
+
+def test_same_day_schedule(monkeypatch):
+    monkeypatch.setattr(monitor, 'get_store', lambda source: None)
+    iex = SourceService('iex', 'America/New_York', '17:30')
+    now = pd.Timestamp('2026-10-16 12:00').tz_localize('America/New_York')
+    assert iex.get_next_run(now) == (pd.Timestamp('2026-10-16'), pd.Timestamp('2026-10-16 17:30').tz_localize('America/New_York'))
+    assert iex.get_last_session(now) == pd.Timestamp('2026-10-15')
+
+def test_history_row_sums_all_sources_of_a_session(monkeypatch):
+    monkeypatch.setattr(daemon, 'session_counts', {})
+    assert daemon.add_session_counts('2026-10-16', 'iex', (3, 1, 250)) == [3, 1, 250]
+    assert daemon.add_session_counts('2026-10-16', 'quandl', (5, 2, 400)) == [8, 3, 650]
+    # Evaluating a source again replaces its counts
+    assert daemon.add_session_counts('2026-10-16', 'iex', (4, 1, 250)) == [9, 3, 650]
+    assert daemon.add_session_counts('2026-10-19', 'iex', (1, 0, 250)) == [1, 0, 250]
+
+def test_old_sessions_are_dropped(monkeypatch):
+    monkeypatch.setattr(daemon, 'session_counts', {})
+    for day in range(1, 11):
+        daemon.add_session_counts(f'2026-10-{day:02d}', 'iex', (0, 0, 1))
+    assert sorted(daemon.session_counts) == [f'2026-10-{day:02d}' for day in range(4, 11)]
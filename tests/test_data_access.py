@@ -0,0 +1,54 @@
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from data_access import DataAccess
+
+@pytest.fixture
+def data_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+
+def create_database(file_name, symbol, start, end):
+    data_access = DataAccess(file_name)
+    dates = pd.bdate_range(start, end)
+    data_access.write_to_db(pd.DataFrame({'Close': range(1, len(dates) + 1)}, index=dates), symbol)
+    data_access.writer.close()
+    data_access.database.dispose()
+
+def fail(*args, **kwargs):
+    raise AssertionError('Unchanged DB file read again')
+
+def test_imported_database_is_left_in_place(data_directory, monkeypatch):
+    create_database('legacy', 'A', '2026-09-01', '2026-10-01')
+    with open('data/legacy.sqlite', 'rb') as legacy_file:
+        content = legacy_file.read()
+    store = DataAccess('stocks')
+    store.import_database('legacy')
+    assert store.get_last_dates(['A']) == {'A': datetime(2026, 10, 1)}
+    with open('data/legacy.sqlite', 'rb') as legacy_file:
+        assert legacy_file.read() == content
+    # Also a later process does not import the unchanged file again
+    monkeypatch.setattr(sqlite3, 'connect', fail)
+    store.import_database('legacy')
+    DataAccess('stocks').import_database('legacy')
+
+def test_changed_database_is_imported_again(data_directory):
+    create_database('legacy', 'A', '2026-09-01', '2026-10-01')
+    store = DataAccess('stocks')
+    store.import_database('legacy')
+    create_database('legacy', 'B', '2026-09-01', '2026-10-02')
+    store.import_database('legacy')
+    assert store.get_last_dates(['A', 'B']) == {'A': datetime(2026, 10, 1), 'B': datetime(2026, 10, 2)}
+
+def test_end_session_forgets_updated_symbols(data_directory, monkeypatch):
+    create_database('stocks', 'A', '2026-09-01', '2026-10-01')
+    store = DataAccess('stocks')
+    monkeypatch.setattr(store, 'is_current', lambda last_date, end_date, source: True)
+    store.update_symbols(['A'], '2026-09-01', '2026-10-01', 'iex')
+    assert (store.updated, list(store.prefetched)) == ({'A'}, ['A'])
+    store.end_session()
+    assert (store.updated, store.prefetched) == (set(), {})
+    store.writer.close()
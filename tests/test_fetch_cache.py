@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from data_access import DataAccess
+from fetch_cache import FetchCache
+from http_session import CircuitOpenError
+
+now = datetime(2026, 10, 16, 22, 0)
+
+def create_cache():
+    return FetchCache(timedelta(hours=6), timedelta(hours=6), timedelta(hours=30))
+
+def test_fetched_range_is_not_requested_again_within_ttl():
+    cache = create_cache()
+    cache.record('iex', 'A', '2026-01-01', '2026-10-16', True, now)
+    assert not cache.is_due('iex', 'A', '2026-01-01', '2026-10-16', now + timedelta(hours=5))
+    assert cache.is_due('iex', 'A', '2026-01-01', '2026-10-16', now + timedelta(hours=6))
+    assert cache.is_due('iex', 'A', '2026-01-01', '2026-10-17', now + timedelta(hours=1))
+
+def test_failure_recheck_doubles_up_to_max_recheck():
+    cache = create_cache()
+    intervals = []
+    for _ in range(5):
+        cache.record('iex', 'A', '2026-01-01', '2026-10-16', False, now)
+        intervals.append(cache.records[('iex', 'A')]['next_check'] - now)
+    assert intervals == [timedelta(hours=hours) for hours in (6, 12, 24, 30, 30)]
+    assert not cache.is_due('iex', 'A', '2026-01-01', '2026-10-16', now + timedelta(hours=29))
+
+def test_success_resets_failures():
+    cache = create_cache()
+    cache.record('iex', 'A', '2026-01-01', '2026-10-16', False, now)
+    cache.record('iex', 'A', '2026-01-01', '2026-10-16', False, now)
+    cache.record('iex', 'A', '2026-01-01', '2026-10-16', True, now)
+    assert cache.records[('iex', 'A')]['failures'] == 0
+    cache.record('iex', 'A', '2026-01-01', '2026-10-16', False, now)
+    assert cache.records[('iex', 'A')]['next_check'] == now + timedelta(hours=6)
+
+@pytest.fixture
+def data_access(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    data_access = DataAccess('test')
+    yield data_access
+    data_access.writer.close()
+
+def get_prices(start, end):
+    dates = pd.bdate_range(start, end)
+    return pd.DataFrame({'Close': range(1, len(dates) + 1)}, index=dates)
+
+def test_outage_is_not_recorded(data_access, monkeypatch):
+    def read_remote(symbols, start_date, end_date, source):
+        raise CircuitOpenError('quandl is unavailable')
+    monkeypatch.setattr(data_access, 'read_remote', read_remote)
+    data_access.update_symbols(['A', 'B'], '2026-01-01', '2026-10-16', 'quandl')
+    assert data_access.fetch_cache.records == {}
+    assert data_access.fetch_cache.is_due('quandl', 'A', '2026-01-01', '2026-10-16')
+
+def test_unknown_symbol_fails(data_access, monkeypatch):
+    def read_remote(symbols, start_date, end_date, source):
+        raise ValueError(f'{symbols} not found')
+    monkeypatch.setattr(data_access, 'read_remote', read_remote)
+    data_access.update_symbols(['A'], '2026-01-01', '2026-10-16', 'quandl')
+    assert data_access.fetch_cache.records[('quandl', 'A')]['failures'] == 1
+    assert not data_access.fetch_cache.is_due('quandl', 'A', '2026-01-01', '2026-10-16')
+
+def test_no_new_prices_of_stored_symbol_is_no_failure(data_access, monkeypatch):
+    data_access.write_to_db(get_prices('2026-01-01', '2026-10-01'), 'A')
+    monkeypatch.setattr(data_access, 'read_remote', lambda symbols, start_date, end_date, source: pd.DataFrame())
+    data_access.update_symbols(['A'], '2026-01-01', '2026-10-16', 'quandl')
+    assert data_access.fetch_cache.records[('quandl', 'A')]['failures'] == 0
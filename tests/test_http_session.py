@@ -0,0 +1,134 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+import http_session
+from fetcher import RateLimiter
+from http_session import CircuitBreaker, CircuitOpenError, RetryingSession, SourceUnavailableError
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers with the next status of the server's responses, /redirect redirects to itself."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if (self.path == '/redirect'):
+            self.send_response(302)
+            self.send_header('Location', '/redirect')
+        else:
+            status = self.server.responses.pop(0) if len(self.server.responses) > 0 else 200
+            self.send_response(status)
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    server.responses = []
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(http_session.time, 'monotonic', lambda: now[0])
+    return now
+
+def create_session(failures=2, cooldown=60, retries=2):
+    session = RetryingSession('stub')
+    session.retries = retries
+    session.backoff = 0
+    session.breaker = CircuitBreaker(failures, cooldown)
+    return session
+
+def url(stub, path='/'):
+    return f'http://127.0.0.1:{stub.server_port}{path}'
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(2, 60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+def test_breaker_lets_one_trial_through_after_cooldown(clock):
+    breaker = CircuitBreaker(1, 60)
+    breaker.record_failure()
+    clock[0] += 61
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+    assert breaker.failures == 0
+
+def test_failed_trial_opens_breaker_again(clock):
+    breaker = CircuitBreaker(1, 60)
+    breaker.record_failure()
+    clock[0] += 61
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock[0] += 61
+    assert breaker.allow()
+
+def test_retries_server_errors(stub):
+    stub.responses = [503, 500]
+    session = create_session(failures=5)
+    assert session.get(url(stub)).status_code == 200
+    assert stub.requests == 3
+
+def test_client_errors_are_not_retried(stub):
+    stub.responses = [404]
+    session = create_session()
+    assert session.get(url(stub)).status_code == 404
+    assert stub.requests == 1
+    assert session.breaker.failures == 0
+
+def test_server_errors_after_all_retries_raise(stub):
+    stub.responses = [503, 503, 503]
+    session = create_session(failures=5)
+    with pytest.raises(SourceUnavailableError):
+        session.get(url(stub))
+    assert stub.requests == 3
+
+def test_open_breaker_stops_requests(stub):
+    stub.responses = [503, 503]
+    session = create_session(failures=2, retries=1)
+    with pytest.raises(SourceUnavailableError):
+        session.get(url(stub))
+    with pytest.raises(CircuitOpenError):
+        session.get(url(stub))
+    assert stub.requests == 2
+
+def test_unexpected_error_resolves_trial(stub, clock):
+    session = create_session(failures=1, retries=0)
+    session.max_redirects = 2
+    stub.responses = [503]
+    with pytest.raises(SourceUnavailableError):
+        session.get(url(stub))
+    clock[0] += 61
+    with pytest.raises(requests.exceptions.TooManyRedirects):
+        session.get(url(stub, '/redirect'))
+    # The failed trial opened the breaker again instead of blocking the source for good
+    with pytest.raises(CircuitOpenError):
+        session.get(url(stub))
+    clock[0] += 61
+    assert session.get(url(stub)).status_code == 200
+
+def test_retries_wait_for_rate_limiter(stub):
+    stub.responses = [503, 429]
+    session = create_session(failures=5)
+    waits = []
+    session.rate_limiter = RateLimiter(0)
+    session.rate_limiter.wait = lambda: waits.append(stub.requests)
+    assert session.get(url(stub)).status_code == 200
+    assert waits == [1, 2]
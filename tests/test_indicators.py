@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from technical_indicators import IndicatorStates, Indicators, rsi, rsi_matrix, get_sma, get_ema
+
+@pytest.fixture
+def closings():
+    random = np.random.default_rng(7)
+    dates = pd.bdate_range('2025-01-01', periods=300)
+    return pd.Series(100 + np.cumsum(random.normal(0, 1, len(dates))), index=dates, name='Close')
+
+def get_batch(closings):
+    """Returns the indicators over the complete series, one column per Indicators name."""
+    df = pd.DataFrame(closings)
+    df = rsi('TEST', df, closings)
+    df = get_sma(df, closings, 10)
+    df = get_ema(df, closings, 10)
+    return get_ema(df, closings, 100)
+
+def create_states(closings):
+    """Returns IndicatorStates of one symbol with the closings as (dates, 1) price array."""
+    return IndicatorStates(['TEST']), closings.to_numpy()[:, np.newaxis]
+
+def test_states_match_batch_indicators(closings):
+    states, prices = create_states(closings)
+    states.advance(prices, closings.index, np.array([len(closings) - 1]))
+    batch = get_batch(closings).iloc[-1]
+    for indicator in Indicators:
+        assert states.get_values(indicator)[0] == pytest.approx(batch[indicator.name])
+
+def test_states_advanced_day_by_day_match_batch(closings):
+    states, prices = create_states(closings)
+    states.advance(prices[:100], closings.index[:100], np.array([99]))
+    batch = get_batch(closings)
+    for end in range(120, closings.size + 1, 30):
+        # Every run stores the states and feeds the window of the last 80 bars, of which only the new ones are used
+        rows = states.get_rows([0])
+        states = IndicatorStates(['TEST'])
+        states.set_rows([0], rows)
+        changed = states.advance(prices[end - 80:end], closings.index[end - 80:end], np.array([79]))
+        assert list(changed) == [True]
+        for indicator in Indicators:
+            assert states.get_values(indicator)[0] == pytest.approx(batch[indicator.name].iloc[end - 1])
+    assert list(states.advance(prices[end - 80:end], closings.index[end - 80:end], np.array([79]))) == [False]
+
+def test_states_advance_all_symbols_up_to_their_last_row(closings):
+    prices = pd.DataFrame({'A': closings, 'B': closings * 2, 'C': closings[::-1].to_numpy()})
+    prices.iloc[:40, 2] = np.nan
+    last_rows = np.array([len(prices) - 1, len(prices) - 11, len(prices) - 1])
+    states = IndicatorStates(prices.columns)
+    states.advance(prices.to_numpy(), prices.index, last_rows)
+    for index, symbol in enumerate(prices.columns):
+        series = prices[symbol].iloc[:last_rows[index] + 1].dropna()
+        batch = get_batch(series).iloc[-1]
+        assert states.get_last_date(index) == series.index[-1].strftime('%Y-%m-%d')
+        for indicator in Indicators:
+            assert states.get_values(indicator)[index] == pytest.approx(batch[indicator.name])
+
+def test_history_matches_batch_indicators(closings):
+    states, prices = create_states(closings)
+    states.advance(prices[:-79], closings.index[:-79], np.array([len(closings) - 80]))
+    states.advance(prices[-80:], closings.index[-80:], np.array([79]))
+    history = states.get_history(prices[-80:], np.array([79]))
+    batch = get_batch(closings)[-80:]
+    for name in ['RSI14', 'EMA10', 'EMA100']:
+        np.testing.assert_allclose(history[name][:, 0], batch[name].to_numpy())
+    # The SMA is computed over the window, like compute_indicators
+    np.testing.assert_allclose(history['SMA10'][9:, 0], batch['SMA10'].to_numpy()[9:])
+    assert np.isnan(history['SMA10'][:9, 0]).all()
+
+def test_history_of_new_symbol_starts_at_first_price(closings):
+    states, prices = create_states(closings[:20])
+    states.advance(prices, closings.index[:20], np.array([19]))
+    history = states.get_history(prices, np.array([19]))
+    # The first bars have no RSI yet
+    assert np.isnan(history['RSI14'][:, 0]).sum() == 14
+    np.testing.assert_allclose(history['SMA10'][:, 0], closings[:20].rolling(10).mean().to_numpy())
+
+def test_preview_rsi_matches_next_bar(closings):
+    states, prices = create_states(closings)
+    states.advance(prices[:-1], closings.index[:-1], np.array([len(closings) - 2]))
+    preview = states.preview_rsi(14, [0], [closings.iloc[-1]])[0]
+    states.advance(prices, closings.index, np.array([len(closings) - 1]))
+    assert preview == pytest.approx(states.get_values(Indicators.RSI14)[0])
+
+def test_states_the_prices_do_not_reach_back_to_start_over(closings):
+    states, prices = create_states(closings)
+    states.advance(prices[:100], closings.index[:100], np.array([99]))
+    states.advance(prices[150:], closings.index[150:], np.array([149]))
+    fresh, _ = create_states(closings)
+    fresh.advance(prices[150:], closings.index[150:], np.array([149]))
+    np.testing.assert_array_equal(states.get_rows([0]), fresh.get_rows([0]))
+
+def test_rsi_matrix_matches_rsi_with_gaps(closings):
+    prices = pd.DataFrame({'A': closings, 'B': closings[::-1].to_numpy(), 'C': closings * 2})
+    prices.iloc[:30, 0] = np.nan
+    prices.iloc[[100, 101, 150], 1] = np.nan
+    prices.iloc[-1, 2] = np.nan
+    result = rsi_matrix(prices.to_numpy())
+    for index, symbol in enumerate(prices.columns):
+        expected = rsi(symbol, pd.DataFrame(index=prices.index), prices[symbol])['RSI14']
+        np.testing.assert_allclose(result[:, index], expected.to_numpy())
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from rules import Rule, get_rules, get_run_starts, get_streaks
+
+def get_streak(column, last_row):
+    """Start row and length of the run ending at last_row, counted backwards one day at a time."""
+    if (last_row < 0 or not column[last_row]):
+        return -1, 0
+    start = last_row
+    while (start > 0 and column[start - 1]):
+        start -= 1
+    return start, last_row - start + 1
+
+def test_run_starts():
+    mask = np.array([[True, False], [True, True], [False, True], [True, True]])
+    np.testing.assert_array_equal(get_run_starts(mask), [[0, -1], [0, 1], [-1, 1], [3, 1]])
+
+def test_streaks_match_day_by_day_count():
+    random = np.random.default_rng(3)
+    mask = random.random((60, 200)) < 0.7
+    last_rows = random.integers(-1, 60, 200)
+    starts, lengths = get_streaks(mask, last_rows)
+    for column in range(mask.shape[1]):
+        assert (starts[column], lengths[column]) == get_streak(mask[:, column], last_rows[column])
+
+def test_streak_of_unknown_last_row_is_empty():
+    starts, lengths = get_streaks(np.ones((5, 2), dtype=bool), np.array([-1, 4]))
+    assert list(starts) == [-1, 0]
+    assert list(lengths) == [0, 5]
+
+def get_operands(rsi):
+    rsi = np.array(rsi, dtype=float)
+    return {'RSI14': rsi, 'min_rsi': np.full((1, rsi.shape[1]), 30.0)}
+
+def test_rule_holds_for_min_days():
+    rule = Rule('Oversold for a week', ('RSI14', '<', 'min_rsi'), min_days=3)
+    operands = get_operands([[25, 25, 40], [25, 25, 25], [25, 40, 25], [25, 25, 25]])
+    alarming, starts = rule.evaluate(operands, np.array([3, 3, 3]))
+    assert list(alarming) == [True, False, True]
+    assert list(starts) == [0, 3, 1]
+
+def test_crossing_alarms_on_its_day_only():
+    rule = Rule('Recovered', (30, 'crosses below', 'RSI14'))
+    operands = get_operands([[np.nan, 25, 25], [35, 35, 25], [35, 35, 35]])
+    alarming, _ = rule.evaluate(operands, np.array([1, 1, 2]))
+    # The first symbol only gets an RSI on the day it is above 30, that is no crossing
+    assert list(alarming) == [False, True, True]
+    alarming, _ = rule.evaluate(operands, np.array([2, 2, 2]))
+    assert list(alarming) == [False, False, True]
+
+def test_unknown_operand_is_rejected():
+    with pytest.raises(ValueError):
+        get_rules({'Broken': {'condition': ('RSI15', '<', 30)}})
@@ -0,0 +1,74 @@
+import pickle
+
+import pandas as pd
+import pytest
+
+import config
+import monitor
+import sharding
+from alarms import AlarmCollector
+from instrumentation import RunReport, report
+from stock import Stock
+
+def create_stock(symbol, last_rsi, exceeded_since='2026-10-01', source='iex'):
+    stock = Stock(80, f'{symbol} Inc.', symbol, object(), source, 30, 70)
+    stock.closings = pd.Series([1.0, 2.0], index=pd.to_datetime(['2026-10-15', '2026-10-16']))
+    stock.last_rsi = last_rsi
+    stock.exceeded_since = exceeded_since
+    return stock
+
+def evaluate(stocks, rule_stocks=()):
+    """Returns the pickled results of a shard which found the given alarms."""
+    alarms = AlarmCollector(2)
+    for stock in stocks:
+        if (stock.last_rsi < 30):
+            alarms.add_below(stock)
+        else:
+            alarms.add_above(stock)
+        stock.release()
+    for stock in rule_stocks:
+        alarms.add_rule('Oversold for a week', stock, '2026-10-09')
+    shard_report = RunReport()
+    shard_report.count('rows_fetched', 10 * len(stocks), 'iex')
+    return pickle.loads(pickle.dumps((alarms, shard_report)))
+
+@pytest.fixture
+def merged(monkeypatch):
+    monkeypatch.setattr(config, 'alarm_report_top', 2)
+    monkeypatch.setattr(monitor, 'alarms', None)
+    monkeypatch.setattr(monitor, 'evaluated_stocks', {})
+    report.reset()
+    yield
+    report.reset()
+
+def test_unpickled_stock_keeps_summary_only():
+    stock = pickle.loads(pickle.dumps(create_stock('A', 20, exceeded_since=None)))
+    assert (stock.data_access, stock.closings, stock.last_rsi) == (None, None, 20)
+    # Prices are never loaded again
+    assert stock.get_rsi_exceeded_since_date() is None
+    assert 'Exceeded since: unknown' in monitor.get_mail_text(stock)
+
+def test_released_stock_is_not_loaded_again():
+    stock = create_stock('A', 20, exceeded_since=None)
+    stock.release()
+    assert stock.get_rsi_exceeded_since_date() is None
+
+def test_merge_keeps_most_extreme_alarms_of_all_shards(merged):
+    first = evaluate([create_stock('A', 25), create_stock('B', 10), create_stock('C', 80)])
+    second = evaluate([create_stock('D', 5), create_stock('E', 90), create_stock('F', 75)], [create_stock('D', 5)])
+    sharding.merge([sharding.ShardResult('iex', 0, 2, 40, *first), sharding.ShardResult('iex', 1, 2, 60, *second)])
+    assert [stock.symbol for stock in monitor.alarms.get_below()] == ['D', 'B']
+    assert [stock.symbol for stock in monitor.alarms.get_above()] == ['C', 'E']
+    assert (monitor.alarms.below_count, monitor.alarms.above_count) == (3, 3)
+    assert set(monitor.alarms.zones) == {'A', 'B', 'C', 'D', 'E', 'F', 'D|Oversold for a week'}
+    count, due, kept = monitor.alarms.get_rules()['Oversold for a week']
+    assert (count, due, [(stock.symbol, since) for stock, since in kept]) == (1, 1, [('D', '2026-10-09')])
+    assert monitor.evaluated_stocks == {'iex': 100}
+    assert report.counters[('iex', None)]['rows_fetched'] == 60
+
+def test_merged_alarms_render_without_prices(merged):
+    results = evaluate([create_stock('A', 20), create_stock('B', 80, exceeded_since=None)])
+    sharding.merge([sharding.ShardResult('iex', 0, 1, 2, *results)])
+    message = monitor.get_alarm_message('2026-10-16', 2, monitor.alarms)
+    assert 'Exceeded since: 2026-10-01\tSymbol: A Inc. (A)' in message
+    assert 'Exceeded since: unknown\tSymbol: B Inc. (B)' in message
@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import (AbstractHolidayCalendar, Holiday, GoodFriday, EasterMonday, USMartinLutherKingJr,
+    USPresidentsDay, USMemorialDay, USLaborDay, USThanksgivingDay, nearest_workday, sunday_to_monday)
+
+class USExchangeHolidays(AbstractHolidayCalendar):
+    """Full day closures of NYSE and NASDAQ."""
+    rules = [
+        Holiday('New Years Day', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date=datetime(2022, 1, 1), observance=nearest_workday),
+        Holiday('Independence Day', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday)
+    ]
+
+class FSEHolidays(AbstractHolidayCalendar):
+    """Full day closures of Xetra and the Frankfurt Stock Exchange. Holidays on weekends are not moved."""
+    rules = [
+        Holiday('New Years Day', month=1, day=1),
+        GoodFriday,
+        EasterMonday,
+        Holiday('Labour Day', month=5, day=1),
+        Holiday('Christmas Eve', month=12, day=24),
+        Holiday('Christmas', month=12, day=25),
+        Holiday('Boxing Day', month=12, day=26),
+        Holiday('New Years Eve', month=12, day=31)
+    ]
+
+holiday_calendars = {'US': USExchangeHolidays(), 'FSE': FSEHolidays()}
+
+# Exchange the symbols of every remote source are traded on
+source_exchanges = {'quandl': 'FSE', 'stooq': 'US', 'iex': 'US'}
+
+class TradingCalendar:
+    """
+    The trading days of one exchange between two dates: weekdays without the exchange holidays.
+    Aligning a price series is a binary search of the calendar against the series dates, so all
+    series of a run share the same index and no per symbol date ranges are built.
+    \n
+    Constructor Params:
+    - exchange   -- key of holiday_calendars
+    - start_date -- first date, yyyy-mm-dd
+    - end_date   -- last date, yyyy-mm-dd
+    """
+
+    def __init__(self, exchange, start_date, end_date):
+        self.exchange = exchange
+        holidays = holiday_calendars[exchange].holidays(start_date, end_date)
+        self.days = pd.bdate_range(start_date, end_date).difference(holidays)
+        self.day_values = self.days.values
+
+    def align(self, prices):
+        """
+        Returns the given price series on the trading days of this calendar, every day carrying
+        the latest price at or before it. Prices on days the exchange is closed are not repeated
+        as bars of their own.
+        """
+        prices = prices.dropna()
+        if (not prices.index.is_monotonic_increasing):
+            prices = prices.sort_index()
+        # Position of the latest price at or before every trading day, -1 before the first price
+        positions = prices.index.values.searchsorted(self.day_values, side='right') - 1
+        values = prices.to_numpy(dtype=float)[positions]
+        values[positions < 0] = np.nan
+        return pd.Series(values, index=self.days, name=prices.name)
+
+    def get_previous_trading_day(self, date_string):
+        """Returns the last trading day before the given date (yyyy-mm-dd) as datetime, None if the calendar does not reach back far enough."""
+        position = self.day_values.searchsorted(np.datetime64(date_string), side='left') - 1
+        if (position < 0):
+            return None
+        return self.days[position].to_pydatetime()
+
+calendars = {}
+calendars_lock = threading.Lock()
+
+def get_calendar(source, start_date, end_date):
+    """Returns the shared TradingCalendar of the exchange of the given remote source. Built once per date range."""
+    key = (source_exchanges.get(source, 'US'), start_date, end_date)
+    with calendars_lock:
+        if (key not in calendars):
+            calendars[key] = TradingCalendar(*key)
+        return calendars[key]
+
+def get_previous_trading_day(source, date_string):
+    """Returns the last trading day before the given date (yyyy-mm-dd) on the exchange of the given remote source as datetime."""
+    # Two weeks always contain a trading day
+    start_date = datetime.strftime(datetime.strptime(date_string, '%Y-%m-%d') - timedelta(14), '%Y-%m-%d')
+    return get_calendar(source, start_date, date_string).get_previous_trading_day(date_string)